@@ -1,11 +1,21 @@
 import json
+import argparse
+import glob
 import logging
+import os
+import time
 from collections import Counter
-from typing import Dict, List
+from typing import Dict, List, Optional
 import socket
 import whois
 from datetime import datetime, timedelta
 
+from company_classifier import CompanyClassifier
+from numpy_stats import RESOLUTIONS, ColumnarRequests
+from ownership_cache import OwnerClassifier, OwnershipCache, registrable_domain
+from request_stats import RequestStats, aggregate_files_parallel, open_log, rotated_log_files
+from rollup_store import RollupStore
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -27,21 +37,143 @@ COMPANIES = {
     'fastly': ['fastly'],
 }
 
+# Default table for --companies; a JSON file with the same layout can replace it
+COMPANIES_FILE = 'companies.json'
+
+company_classifier = CompanyClassifier(COMPANIES)
+
+def load_companies(path: str = COMPANIES_FILE):
+    """Replace the built-in company table with a `{"company": ["keyword", ...]}` JSON file."""
+    global company_classifier
+    company_classifier = CompanyClassifier.from_file(path)
+    logger.info(f"Loaded company table from {path}")
+
 def get_company_from_domain(domain: str) -> str:
     """Determine which company a domain belongs to."""
-    domain_lower = domain.lower()
-    
-    for company, keywords in COMPANIES.items():
-        if any(keyword in domain_lower for keyword in keywords):
-            return company
-    
-    return 'other'
+    return company_classifier.classify(domain)
 
-def analyze_blocked_requests():
-    """Analyze the blocked requests and generate statistics."""
+def attribute_by_owner(paths: List[str], cache_path: str, offline: bool = False,
+                       ttl_days: float = 30, workers: int = 4, rate: float = 2.0):
+    """Attribute domains no keyword matches to the owner of their registrable domain.
+
+    One pass over the logs collects those domains; their owners come from
+    the ownership cache, and only missing or expired ones are looked up.
+    """
+    global company_classifier
+    unmatched = set()
+    for path in paths:
+        try:
+            with open_log(path) as f:
+                for line in f:
+                    try:
+                        domain = json.loads(line)['domain']
+                    except (ValueError, KeyError, TypeError):
+                        continue
+                    if company_classifier.classify(domain) == company_classifier.default:
+                        unmatched.add(registrable_domain(domain))
+        except (OSError, EOFError) as e:
+            logger.warning(f"Could not read all of {path}: {str(e)}")
+    cache = OwnershipCache(cache_path, ttl=ttl_days * 86400, offline=offline,
+                           workers=workers, rate=rate)
     try:
+        owners = cache.resolve(unmatched)
+    finally:
+        cache.close()
+    known = sum(owner is not None for owner in owners.values())
+    logger.info(f"Found owners for {known} of {len(unmatched)} unmatched domains")
+    company_classifier = OwnerClassifier(company_classifier, owners)
+
+def load_blocked_requests(path: str = 'blocked_requests.jsonl') -> List[Dict]:
+    """Load blocked requests from the JSON-lines log, one record per line.
+
+    Falls back to the older `blocked_requests.json` array if there is no log.
+    """
+    if not os.path.exists(path) and os.path.exists('blocked_requests.json'):
         with open('blocked_requests.json', 'r') as f:
-            blocked_requests = json.load(f)
+            return json.load(f)
+    with open(path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def stream_blocked_requests(path: str = 'blocked_requests.jsonl',
+                            hll_precision: Optional[int] = None) -> RequestStats:
+    """Aggregate the log and its rotated backups in one pass without loading them.
+
+    Falls back to the older `blocked_requests.json` array if there is no log.
+    """
+    stats = RequestStats(get_company_from_domain, hll_precision)
+    files = rotated_log_files(path)
+    if files:
+        stats.add_files(files)
+    elif os.path.exists('blocked_requests.json'):
+        for req in load_blocked_requests(path):
+            stats.add(req['timestamp'], req['domain'])
+    else:
+        raise FileNotFoundError(path)
+    if stats.malformed:
+        logger.warning(f"Skipped {stats.malformed} malformed log lines")
+    return stats
+
+def expand_log_patterns(patterns: List[str]) -> List[str]:
+    """Return the files matching any of the glob patterns, sorted."""
+    return sorted({path for pattern in patterns for path in glob.glob(pattern)})
+
+def analyze_rollups(db_path: str, paths: List[str], since: Optional[str] = None,
+                    until: Optional[str] = None):
+    """Add new log records to the rollup store, then report [since, until) from the rollups."""
+    store = RollupStore(db_path)
+    try:
+        start = time.monotonic()
+        ingested = store.ingest(paths, get_company_from_domain)
+        logger.info(f"Added {ingested} new records to {db_path} in {time.monotonic() - start:.2f}s")
+        stats = store.query(since, until)
+    finally:
+        store.close()
+    if not stats['total_requests']:
+        logger.error("No blocked requests in the selected time range")
+        return
+    report_statistics(stats)
+
+def analyze_columnar(paths: List[str], resolution: str = 'hour', since: Optional[str] = None,
+                     until: Optional[str] = None, top: int = 10):
+    """Analyze the logs with the NumPy backend at minute, hour or day resolution."""
+    start = time.monotonic()
+    requests = ColumnarRequests.from_files(paths, get_company_from_domain).between(since, until)
+    logger.info(f"Loaded {len(requests)} records in {time.monotonic() - start:.2f}s")
+    if not len(requests):
+        logger.error("No blocked requests in the selected time range")
+        return
+    stats = requests.to_dict(resolution)
+    stats['top_domains'] = requests.top_domains(top)
+    report_statistics(stats, resolution=resolution)
+
+def analyze_log_files(patterns: List[str], workers: Optional[int] = None,
+                      hll_precision: Optional[int] = None):
+    """Analyze every log file matching the glob patterns in parallel worker processes."""
+    paths = expand_log_patterns(patterns)
+    if not paths:
+        logger.error(f"No log files match {', '.join(patterns)}")
+        return
+    start = time.monotonic()
+    stats = aggregate_files_parallel(paths, company_classifier.classify, hll_precision, workers)
+    logger.info(f"Analyzed {len(paths)} log files in {time.monotonic() - start:.2f}s")
+    if stats.malformed:
+        logger.warning(f"Skipped {stats.malformed} malformed log lines")
+    report_statistics(stats.to_dict(), estimated=bool(hll_precision))
+
+def analyze_blocked_requests(stream: bool = False, path: str = 'blocked_requests.jsonl',
+                             hll_precision: Optional[int] = None):
+    """Analyze the blocked requests and generate statistics."""
+    if stream or hll_precision:
+        try:
+            stats = stream_blocked_requests(path, hll_precision)
+        except FileNotFoundError:
+            logger.error("No blocked requests file found")
+            return
+        report_statistics(stats.to_dict(), estimated=bool(hll_precision))
+        return
+
+    try:
+        blocked_requests = load_blocked_requests(path)
     except FileNotFoundError:
         logger.error("No blocked requests file found")
         return
@@ -63,32 +195,96 @@ def analyze_blocked_requests():
         hour = timestamp.strftime('%Y-%m-%d %H:00')
         requests_by_hour[hour] += 1
     
+    report_statistics({
+        'total_requests': total_requests,
+        'unique_domains': unique_domains,
+        'company_stats': dict(company_counter),
+        'hourly_stats': dict(requests_by_hour)
+    })
+
+def report_statistics(stats: Dict, estimated: bool = False, resolution: str = 'hour'):
+    """Print the statistics and save them to blocker_statistics.json."""
+    total_requests = stats['total_requests']
+    
     # Print statistics
     print("\n=== DNS Ad Blocker Statistics ===")
     print(f"Total blocked requests: {total_requests}")
-    print(f"Unique blocked domains: {unique_domains}")
+    print(f"Unique blocked domains: {'~' if estimated else ''}{stats['unique_domains']}")
     
     print("\nTop blocked companies:")
-    for company, count in company_counter.most_common():
+    for company, count in Counter(stats['company_stats']).most_common():
         percentage = (count / total_requests) * 100
         print(f"{company}: {count} requests ({percentage:.1f}%)")
     
-    print("\nRequests by hour:")
-    for hour, count in sorted(requests_by_hour.items()):
+    if 'top_domains' in stats:
+        print("\nTop blocked domains:")
+        for domain, count in stats['top_domains'].items():
+            print(f"{domain}: {count} requests")
+    
+    print(f"\nRequests by {resolution}:")
+    for hour, count in sorted(stats['hourly_stats'].items()):
         print(f"{hour}: {count} requests")
     
     # Save detailed statistics to file
-    stats = {
-        'total_requests': total_requests,
-        'unique_domains': unique_domains,
-        'company_stats': dict(company_counter),
-        'hourly_stats': dict(requests_by_hour)
-    }
-    
     with open('blocker_statistics.json', 'w') as f:
         json.dump(stats, f, indent=2)
     
     logger.info("Statistics saved to blocker_statistics.json")
 
 if __name__ == '__main__':
-    analyze_blocked_requests() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Analyze blocked DNS requests')
+    parser.add_argument('--log', default='blocked_requests.jsonl',
+                        help='blocked request log; rotated .N.gz backups are read too when streaming')
+    parser.add_argument('--stream', action='store_true',
+                        help='aggregate the logs in one pass without loading them into memory')
+    parser.add_argument('--hll', type=int, nargs='?', const=14, default=None, metavar='PRECISION',
+                        help='estimate unique domains with a HyperLogLog sketch of 2**PRECISION '
+                             'registers (implies --stream, default precision 14)')
+    parser.add_argument('--companies', metavar='PATH',
+                        help=f'JSON company table to use instead of the built-in one '
+                             f'(default: {COMPANIES_FILE} if it exists)')
+    parser.add_argument('--logs', action='append', default=[], metavar='GLOB',
+                        help='analyze all log files matching GLOB (plain or .gz) in parallel, '
+                             'e.g. "logs/*/blocked_requests*.jsonl*" (repeatable)')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='worker processes for --logs (default: number of CPUs)')
+    parser.add_argument('--rollup', nargs='?', const='blocker_rollups.db', default=None,
+                        metavar='DB',
+                        help='add only new log records to a SQLite rollup store and report '
+                             'from it (default blocker_rollups.db)')
+    parser.add_argument('--numpy', action='store_true',
+                        help='load the logs into NumPy columns and aggregate them vectorized')
+    parser.add_argument('--resolution', choices=sorted(RESOLUTIONS), default='hour',
+                        help='with --numpy, width of the time buckets (default hour)')
+    parser.add_argument('--top', type=int, default=10,
+                        help='with --numpy, number of top blocked domains to list')
+    parser.add_argument('--since', help='with --rollup or --numpy, start of the reported range '
+                                        '(ISO date or time)')
+    parser.add_argument('--until', help='with --rollup or --numpy, end of the reported range '
+                                        '(exclusive)')
+    parser.add_argument('--owners', nargs='?', const='ownership_cache.db', default=None,
+                        metavar='DB', help='attribute domains no keyword matches to their whois owner, '
+                        'cached in DB (default: ownership_cache.db)')
+    parser.add_argument('--owners-offline', action='store_true',
+                        help='with --owners, only use cached owners and never look any up')
+    parser.add_argument('--owners-ttl', type=float, default=30, metavar='DAYS',
+                        help='with --owners, days before a cached owner is looked up again (default: 30)')
+    parser.add_argument('--owners-workers', type=int, default=4,
+                        help='with --owners, concurrent whois lookups (default: 4)')
+    parser.add_argument('--owners-rate', type=float, default=2.0, metavar='PER_SECOND',
+                        help='with --owners, maximum whois lookups per second (default: 2)')
+    args = parser.parse_args()
+    if args.companies or os.path.exists(COMPANIES_FILE):
+        load_companies(args.companies or COMPANIES_FILE)
+    log_paths = expand_log_patterns(args.logs) if args.logs else rotated_log_files(args.log)
+    if args.owners:
+        attribute_by_owner(log_paths, args.owners, args.owners_offline, args.owners_ttl,
+                           args.owners_workers, args.owners_rate)
+    if args.rollup:
+        analyze_rollups(args.rollup, log_paths, args.since, args.until)
+    elif args.numpy:
+        analyze_columnar(log_paths, args.resolution, args.since, args.until, args.top)
+    elif args.logs:
+        analyze_log_files(args.logs, args.jobs, args.hll)
+    else:
+        analyze_blocked_requests(args.stream, args.log, args.hll) 
\ No newline at end of file
@@ -0,0 +1,90 @@
+"""Batched UDP receive/send loop shared by the DNS servers.
+
+Instead of one blocking recvfrom/sendto pair per packet, the loop waits for
+the socket to become readable, drains up to `batch_size` datagrams into a
+ring of preallocated buffers with recvfrom_into, handles them, and then
+flushes all replies in one burst.
+"""
+import logging
+import select
+import selectors
+import socket
+import time
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Address = Tuple[str, int]
+Handler = Callable[[memoryview, Address], Optional[bytes]]
+
+
+def send_burst(sock: socket.socket, replies: List[Tuple[bytes, Address]],
+               timeout: float = 1.0) -> int:
+    """Send queued replies on a non-blocking socket; return how many were sent.
+
+    When the socket buffer is full, wait up to `timeout` for it to drain
+    before dropping the remaining replies.
+    """
+    sent = 0
+    for reply, addr in replies:
+        while True:
+            try:
+                sock.sendto(reply, addr)
+                sent += 1
+                break
+            except BlockingIOError:
+                _, writable, _ = select.select([], [sock], [], timeout)
+                if not writable:
+                    logger.warning(f"Send buffer full, dropped {len(replies) - sent} replies")
+                    return sent
+            except OSError as e:
+                logger.error(f"Error sending reply to {addr}: {str(e)}")
+                break
+    return sent
+
+
+def serve_batched(sock: socket.socket, handler: Handler, batch_size: int = 64,
+                  buffer_size: int = 4096, report: Optional[Callable[[], None]] = None,
+                  report_interval: float = 10.0):
+    """Serve datagrams on `sock` forever in batches.
+
+    `handler` gets a memoryview of each datagram that is only valid until it
+    returns, and returns the reply to send (or None/empty for no reply).
+    """
+    sock.setblocking(False)
+    buffers = [bytearray(buffer_size) for _ in range(batch_size)]
+    views = [memoryview(buffer) for buffer in buffers]
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    next_report = time.monotonic() + report_interval
+    try:
+        while True:
+            selector.select(report_interval if report else None)
+            received = []
+            for slot in range(batch_size):
+                try:
+                    length, addr = sock.recvfrom_into(buffers[slot])
+                except BlockingIOError:
+                    break
+                except OSError as e:
+                    # e.g. ICMP errors reported on the socket; keep draining
+                    logger.debug(f"Error receiving datagram: {str(e)}")
+                    continue
+                received.append((views[slot][:length], addr))
+
+            replies = []
+            for packet, addr in received:
+                try:
+                    reply = handler(packet, addr)
+                except Exception as e:
+                    logger.error(f"Error processing request: {str(e)}")
+                    continue
+                if reply:
+                    replies.append((reply, addr))
+            if replies:
+                send_burst(sock, replies)
+            if report and time.monotonic() >= next_report:
+                report()
+                next_report = time.monotonic() + report_interval
+    finally:
+        selector.close()
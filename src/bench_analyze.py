@@ -0,0 +1,65 @@
+"""Benchmark the streaming and NumPy log analysis backends on a generated log.
+
+Usage: python3 bench_analyze.py [--rows 2000000] [--domains 50000]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from analyze_stats import get_company_from_domain
+from numpy_stats import RESOLUTIONS, ColumnarRequests
+from request_stats import RequestStats
+
+
+def write_log(path: str, rows: int, domain_count: int, seed: int):
+    rng = random.Random(seed)
+    companies = ['google', 'doubleclick', 'fbcdn', 'amazon', 'bing', 'tracker', 'metrics']
+    domains = [f"ads{i}.{rng.choice(companies)}.com" for i in range(domain_count)]
+    start = datetime(2025, 6, 1)
+    with open(path, 'w') as f:
+        for _ in range(rows):
+            timestamp = start + timedelta(seconds=rng.randrange(30 * 86400), microseconds=rng.randrange(10**6))
+            f.write(json.dumps({'timestamp': timestamp.isoformat(), 'domain': rng.choice(domains)}) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2_000_000)
+    parser.add_argument('--domains', type=int, default=50_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'blocked_requests.jsonl')
+    write_log(path, args.rows, args.domains, args.seed)
+    print(f"{args.rows} rows, {os.path.getsize(path) / 2**20:.0f} MB")
+
+    start = time.perf_counter()
+    stats = RequestStats(get_company_from_domain)
+    stats.add_file(path)
+    streaming = stats.to_dict()
+    print(f"{'streaming':<28}{time.perf_counter() - start:>8.2f}s")
+
+    start = time.perf_counter()
+    requests = ColumnarRequests.from_files([path], get_company_from_domain)
+    load_time = time.perf_counter() - start
+    print(f"{'numpy load':<28}{load_time:>8.2f}s")
+    start = time.perf_counter()
+    columnar = requests.to_dict()
+    print(f"{'numpy aggregate (hour)':<28}{time.perf_counter() - start:>8.2f}s")
+    for resolution in RESOLUTIONS:
+        start = time.perf_counter()
+        requests.histogram(resolution)
+        print(f"{'numpy histogram (' + resolution + ')':<28}{time.perf_counter() - start:>8.2f}s")
+    start = time.perf_counter()
+    requests.top_domains(10)
+    print(f"{'numpy top 10 domains':<28}{time.perf_counter() - start:>8.2f}s")
+    print(f"results match: {streaming == columnar}")
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Benchmark DNSServer packets per second on loopback, per-packet vs batched I/O.
+
+Usage: python3 bench_batch_io.py [--seconds 5] [--clients 2] [--batch 64]
+"""
+import argparse
+import logging
+import multiprocessing
+import socket
+import struct
+import time
+
+from dns_server import DNSServer
+
+
+def build_query(query_id: int) -> bytes:
+    header = struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0)
+    return header + b'\x07example\x03com\x00' + struct.pack('!HH', 1, 1)
+
+
+def run_server(port: int, batch_size: int):
+    logging.disable(logging.INFO)
+    server = DNSServer('127.0.0.1', port)
+    server.batch_size = batch_size
+    server.serve(server.create_socket())
+
+
+def run_client(port: int, seconds: float, window: int, results: multiprocessing.Queue):
+    """Keep `window` queries in flight and count the answers."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect(('127.0.0.1', port))
+    sock.settimeout(0.2)
+    queries = [build_query(i) for i in range(window)]
+    answered = 0
+    deadline = time.monotonic() + seconds
+    for query in queries:
+        sock.send(query)
+    while time.monotonic() < deadline:
+        try:
+            sock.recv(512)
+            answered += 1
+            sock.send(queries[answered % window])
+        except socket.timeout:
+            # Replies were dropped; refill the window
+            for query in queries:
+                sock.send(query)
+    results.put(answered)
+
+
+def measure(port: int, batch_size: int, args) -> float:
+    ctx = multiprocessing.get_context('fork')
+    server = ctx.Process(target=run_server, args=(port, batch_size), daemon=True)
+    server.start()
+    time.sleep(0.5)
+    results = ctx.Queue()
+    clients = [ctx.Process(target=run_client, args=(port, args.seconds, args.window, results))
+               for _ in range(args.clients)]
+    for client in clients:
+        client.start()
+    answered = sum(results.get() for _ in clients)
+    for client in clients:
+        client.join()
+    server.terminate()
+    server.join()
+    return answered / args.seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--clients', type=int, default=2)
+    parser.add_argument('--window', type=int, default=32, help='queries in flight per client')
+    parser.add_argument('--batch', type=int, default=64)
+    parser.add_argument('--port', type=int, default=15353)
+    args = parser.parse_args()
+
+    per_packet = measure(args.port, 1, args)
+    print(f"{'recvfrom/sendto':<24}{per_packet:>12.0f} packets/s")
+    batched = measure(args.port + 1, args.batch, args)
+    print(f"{f'batched ({args.batch})':<24}{batched:>12.0f} packets/s")
+    print(f"speed-up: {batched / per_packet:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Benchmark blocklist lookups with and without the Bloom prefilter.
+
+Usage: python3 bench_bloom.py [--entries 1000000] [--lookups 200000] [--fp-rate 0.01]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from bench_blocklist import measure_lookups, random_domain
+from blocklist_index import BlocklistIndex, CompiledBlocklist, write_compiled_index
+from bloom_filter import BloomFilter, PrefilteredBlocklist
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--entries', type=int, default=1_000_000)
+    parser.add_argument('--lookups', type=int, default=200_000)
+    parser.add_argument('--fp-rate', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    domains = [random_domain(rng) for _ in range(args.entries)]
+    sample = rng.sample(domains, min(len(domains), args.lookups))
+    workloads = {
+        'hits': sample,
+        'subdomain hits': [f"ads.cdn.{d}" for d in sample],
+        'misses': [random_domain(rng) for _ in range(args.lookups)],
+    }
+
+    start = time.perf_counter()
+    bloom = BloomFilter.from_domains(domains, len(domains), args.fp_rate)
+    build_time = time.perf_counter() - start
+    misses = workloads['misses']
+    false_positives = sum(1 for q in misses if bloom.might_match(q))
+    print(f"{args.entries} entries, Bloom filter {len(bloom.bits) / 2**20:.1f} MB, "
+          f"{bloom.num_hashes} hashes, built in {build_time:.2f}s")
+    print(f"target false-positive rate {args.fp_rate:.2%} per query, "
+          f"measured {false_positives / len(misses):.2%}")
+
+    index = BlocklistIndex(domains)
+    index_path = os.path.join(tempfile.mkdtemp(), 'blocked_domains.idx')
+    write_compiled_index(index_path, domains)
+    compiled = CompiledBlocklist(index_path)
+    engines = {
+        'index': index.is_blocked,
+        'compiled': compiled.is_blocked,
+        'compiled+bloom': PrefilteredBlocklist(compiled, bloom).is_blocked,
+    }
+
+    print(f"\n{'workload':<16}" + ''.join(f"{name + ' (us)':>20}" for name in engines))
+    for name, queries in workloads.items():
+        times = [measure_lookups(check, queries) / len(queries) * 1e6 for check in engines.values()]
+        print(f"{name:<16}" + ''.join(f"{t:>20.2f}" for t in times))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Benchmark DNSTunnelServer chunk throughput on loopback, with and without the file cache.
+
+The whole multi-MB file is downloaded over UDP with `--window` queries in
+flight, then get_file_chunk is timed on its own.
+
+Usage: python3 bench_tunnel.py [--size-mb 4] [--window 16]
+"""
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import os
+import socket
+import struct
+import tempfile
+import time
+
+from dns_wire import iter_records, parse_header, parse_question, skip_questions
+
+FILENAME = 'bench'
+DOMAIN = 'tunnel-domain.live'
+
+
+def build_query(query_id: int, chunk_num: int) -> bytes:
+    header = struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0)
+    labels = f"chunk-{chunk_num}-{FILENAME}.{DOMAIN}".split('.')
+    name = b''.join(bytes([len(label)]) + label.encode() for label in labels) + b'\x00'
+    return header + name + struct.pack('!HH', 16, 1)
+
+
+def parse_response(response: bytes):
+    """Return the chunk number from the echoed question and the TXT payload."""
+    header = parse_header(response)
+    question = parse_question(response, lowercase=False)
+    chunk_num = int(question.qname.split(b'.')[0].split(b'-')[1])
+    offset = skip_questions(response, header.qdcount)
+    record = next(iter_records(response, offset, header.ancount))
+    length = response[record.rdata_offset]
+    return chunk_num, response[record.rdata_offset + 1:record.rdata_offset + 1 + length]
+
+
+def run_server(port: int, max_open_files: int, batch_size: int):
+    from dns_tunnel_server import DNSTunnelServer
+    logging.disable(logging.CRITICAL)
+    server = DNSTunnelServer('127.0.0.1', port, max_open_files=max_open_files)
+    server.start(batch_size)
+
+
+def download(port: int, chunks: int, window: int) -> bytes:
+    """Fetch every chunk with `window` queries in flight; return the file contents."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect(('127.0.0.1', port))
+    sock.settimeout(0.5)
+    received = {}
+    next_chunk = 1
+    in_flight = 0
+    while len(received) < chunks:
+        while in_flight < window and next_chunk <= chunks:
+            sock.send(build_query(next_chunk & 0xFFFF, next_chunk))
+            next_chunk += 1
+            in_flight += 1
+        try:
+            response = sock.recv(4096)
+        except socket.timeout:
+            # Replies were dropped; ask again for every missing chunk
+            missing = [n for n in range(1, next_chunk) if n not in received]
+            for n in missing:
+                sock.send(build_query(n & 0xFFFF, n))
+            in_flight = len(missing)
+            continue
+        in_flight -= 1
+        chunk_num, payload = parse_response(response)
+        received[chunk_num] = payload
+    sock.close()
+    return b''.join(received[n] for n in range(1, chunks + 1))
+
+
+def measure(port: int, max_open_files: int, args, chunks: int, digest: str) -> float:
+    ctx = multiprocessing.get_context('fork')
+    server = ctx.Process(target=run_server, args=(port, max_open_files, args.batch), daemon=True)
+    server.start()
+    time.sleep(0.5)
+    start = time.perf_counter()
+    data = download(port, chunks, args.window)
+    elapsed = time.perf_counter() - start
+    server.terminate()
+    server.join()
+    if hashlib.md5(data).hexdigest() != digest:
+        raise SystemExit("Downloaded file does not match")
+    return elapsed
+
+
+def chunk_reads(max_open_files: int, port: int, chunks: int) -> float:
+    """Time get_file_chunk alone for every chunk; return chunks per second."""
+    from dns_tunnel_server import DNSTunnelServer
+    logging.disable(logging.CRITICAL)
+    server = DNSTunnelServer('127.0.0.1', port, max_open_files=max_open_files)
+    start = time.perf_counter()
+    for chunk_num in range(1, chunks + 1):
+        server.get_file_chunk(FILENAME, chunk_num, 'bench')
+    elapsed = time.perf_counter() - start
+    server.sock.close()
+    return chunks / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=float, default=4)
+    parser.add_argument('--window', type=int, default=16, help='queries in flight')
+    parser.add_argument('--batch', type=int, default=1, help='server batch size')
+    parser.add_argument('--port', type=int, default=15453)
+    args = parser.parse_args()
+
+    # The server serves files/ and writes its log in the working directory
+    os.chdir(tempfile.mkdtemp())
+    os.mkdir('files')
+    contents = os.urandom(int(args.size_mb * 2**20))
+    with open(os.path.join('files', FILENAME), 'wb') as f:
+        f.write(contents)
+    digest = hashlib.md5(contents).hexdigest()
+    chunks = (len(contents) + 99) // 100
+
+    uncached = measure(args.port, 0, args, chunks, digest)
+    print(f"{'open/seek/read per chunk':<28}{len(contents) / uncached / 2**20:>8.2f} MB/s"
+          f"{chunks / uncached:>10.0f} chunks/s")
+    cached = measure(args.port + 1, 64, args, chunks, digest)
+    print(f"{'mmap file cache':<28}{len(contents) / cached / 2**20:>8.2f} MB/s"
+          f"{chunks / cached:>10.0f} chunks/s")
+    print(f"speed-up over loopback: {uncached / cached:.2f}x")
+    uncached_reads = chunk_reads(0, args.port + 2, chunks)
+    cached_reads = chunk_reads(64, args.port + 3, chunks)
+    print(f"get_file_chunk alone: {uncached_reads:.0f} vs {cached_reads:.0f} chunks/s "
+          f"({cached_reads / uncached_reads:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Benchmark DNSTunnelClient downloads through a proxy that adds latency and loss.
+
+The proxy delays every packet by half the round-trip time in each direction
+and drops a share of them, like a distant resolver on a lossy path. The
+same file is downloaded stop-and-wait with a fixed and an adaptive
+retransmission timeout, and with a window of queries in flight.
+
+Usage: python3 bench_tunnel_client.py [--size-kb 256] [--rtt-ms 50] [--loss 0.01] [--window 32]
+"""
+import argparse
+import hashlib
+import heapq
+import logging
+import multiprocessing
+import os
+import random
+import select
+import socket
+import tempfile
+import time
+
+FILENAME = 'bench'
+DOMAIN = 'tunnel-domain.live'
+
+
+def run_server(port: int):
+    from dns_tunnel_server import DNSTunnelServer
+    logging.disable(logging.CRITICAL)
+    DNSTunnelServer('127.0.0.1', port).start()
+
+
+def run_proxy(port: int, server_port: int, rtt: float, loss: float, seed: int):
+    """Forward datagrams between one client and the server with a delay and random loss."""
+    rng = random.Random(seed)
+    front = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    front.bind(('127.0.0.1', port))
+    back = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    back.connect(('127.0.0.1', server_port))
+    client = None
+    queue = []  # (due time, order, socket, packet, address)
+    order = 0
+    while True:
+        timeout = max(queue[0][0] - time.monotonic(), 0) if queue else None
+        readable, _, _ = select.select([front, back], [], [], timeout)
+        for sock in readable:
+            packet, addr = sock.recvfrom(65535)
+            if sock is front:
+                client = addr
+            if rng.random() < loss:
+                continue
+            target = (back, None) if sock is front else (front, client)
+            heapq.heappush(queue, (time.monotonic() + rtt / 2, order, *target, packet))
+            order += 1
+        now = time.monotonic()
+        while queue and queue[0][0] <= now:
+            _, _, sock, addr, packet = heapq.heappop(queue)
+            if addr is None:
+                sock.send(packet)
+            else:
+                sock.sendto(packet, addr)
+
+
+def measure(args, port: int, window: int, size: int, digest: str, fixed_timeout: bool = False):
+    """Download the file once; return the time taken and the client's RTT statistics."""
+    from dns_tunnel_client import DNSTunnelClient, RTTEstimator
+    ctx = multiprocessing.get_context('fork')
+    processes = [
+        ctx.Process(target=run_server, args=(port,), daemon=True),
+        ctx.Process(target=run_proxy, args=(port + 1, port, args.rtt_ms / 1000, args.loss, args.seed),
+                    daemon=True),
+    ]
+    for process in processes:
+        process.start()
+    time.sleep(0.5)
+    client = DNSTunnelClient('127.0.0.1', port + 1, timeout=args.timeout, max_retries=args.retries)
+    if fixed_timeout:
+        # The timeout never adapts or backs off, like the client before RTT estimation
+        client.rtt = RTTEstimator(args.timeout, min_rto=args.timeout, max_rto=args.timeout)
+    chunk_size = client.session_chunk_size(FILENAME, DOMAIN)
+    num_chunks = (size + chunk_size - 1) // chunk_size
+    start = time.perf_counter()
+    ok = client.download_file(FILENAME, DOMAIN, num_chunks, resume=False, window=window)
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.terminate()
+        process.join()
+    if not ok or client.compute_md5(FILENAME) != digest:
+        raise SystemExit(f"Download with window {window} failed")
+    return elapsed, client.rtt.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-kb', type=int, default=256)
+    parser.add_argument('--rtt-ms', type=float, default=50)
+    parser.add_argument('--loss', type=float, default=0.01, help='share of packets dropped each way')
+    parser.add_argument('--window', type=int, default=32)
+    parser.add_argument('--timeout', type=float, default=2.0)
+    parser.add_argument('--retries', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--port', type=int, default=15553)
+    args = parser.parse_args()
+
+    # The server serves files/ and the client writes downloads/ in the working directory
+    logging.disable(logging.WARNING)
+    os.chdir(tempfile.mkdtemp())
+    os.mkdir('files')
+    contents = os.urandom(args.size_kb * 1024)
+    with open(os.path.join('files', FILENAME), 'wb') as f:
+        f.write(contents)
+    digest = hashlib.md5(contents).hexdigest()
+
+    print(f"{args.size_kb} KB, {args.rtt_ms:.0f} ms RTT, {args.loss:.1%} loss each way")
+    runs = [
+        ('stop-and-wait, fixed timeout', 1, True),
+        ('stop-and-wait, adaptive', 1, False),
+        (f"window {args.window}, adaptive", args.window, False),
+    ]
+    results = []
+    for i, (label, window, fixed_timeout) in enumerate(runs):
+        elapsed, rtt = measure(args, args.port + 2 * i, window, len(contents), digest, fixed_timeout)
+        results.append(elapsed)
+        print(f"{label:<32}{elapsed:>8.2f}s{len(contents) / elapsed / 1024:>10.1f} KB/s"
+              f"   srtt {rtt['srtt_ms']} ms, rto {rtt['rto_ms']} ms, {rtt['timeouts']} timeouts")
+    print(f"speed-up: {results[0] / results[1]:.1f}x adaptive, {results[0] / results[2]:.1f}x windowed")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+import bisect
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Iterable, List, NamedTuple, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Compiled index layout: magic, number of blocked and allowed hashes, then both
+# sorted arrays of little-endian 64-bit domain hashes
+INDEX_MAGIC = b'BLKIDX01'
+INDEX_HEADER = struct.Struct('<8sQQ')
+
+# First line of a blocked_domains.txt written by update_blocklist.py
+GENERATION_PREFIX = '# generation: '
+
+
+class BlocklistDelta(NamedTuple):
+    """Block rules added and removed between two generations of the blocklist."""
+    generation: int
+    base_generation: int
+    added: List[str]
+    removed: List[str]
+
+
+def normalize_domain(domain: str) -> str:
+    """Normalize a domain for index lookups (lower-case, no trailing dot)."""
+    return domain.strip().rstrip('.').lower()
+
+
+class BlocklistIndex:
+    """Suffix index over blocked and allowed domains.
+
+    Every rule covers the domain itself and all of its subdomains, so listing
+    `tracker.com` also blocks `ads.tracker.com`. Allowlist entries are
+    exceptions to block rules; when both lists match, the most specific rule
+    wins. A lookup probes one hash set per label of the queried name.
+    """
+
+    def __init__(self, blocked: Optional[Iterable[str]] = None,
+                 allowed: Optional[Iterable[str]] = None):
+        self.blocked = set()
+        self.allowed = set()
+        if blocked:
+            self.update(blocked)
+        if allowed:
+            self.update_allowed(allowed)
+
+    def __len__(self) -> int:
+        return len(self.blocked)
+
+    def add(self, domain: str):
+        """Add a block rule for a domain and its subdomains."""
+        domain = normalize_domain(domain)
+        if domain:
+            self.blocked.add(domain)
+
+    def add_allowed(self, domain: str):
+        """Add an allowlist exception for a domain and its subdomains."""
+        domain = normalize_domain(domain)
+        if domain:
+            self.allowed.add(domain)
+
+    def update(self, domains: Iterable[str]):
+        """Add block rules for several domains."""
+        for domain in domains:
+            self.add(domain)
+
+    def update_allowed(self, domains: Iterable[str]):
+        """Add allowlist exceptions for several domains."""
+        for domain in domains:
+            self.add_allowed(domain)
+
+    def match(self, domain: str) -> Optional[str]:
+        """Return the most specific rule matching a domain, or None."""
+        name = normalize_domain(domain)
+        blocked = self.blocked
+        allowed = self.allowed
+        while name:
+            if name in allowed:
+                return None
+            if name in blocked:
+                return name
+            dot = name.find('.')
+            if dot < 0:
+                break
+            name = name[dot + 1:]
+        return None
+
+    def is_blocked(self, domain: str) -> bool:
+        """Check whether a domain or one of its parents is blocked."""
+        return self.match(domain) is not None
+
+    def apply_delta(self, added: Iterable[str], removed: Iterable[str]):
+        """Add and remove block rules in place."""
+        for domain in removed:
+            self.blocked.discard(normalize_domain(domain))
+        self.update(added)
+
+    @classmethod
+    def from_files(cls, blocked_path: str, allowed_path: Optional[str] = None) -> 'BlocklistIndex':
+        """Build an index from one-domain-per-line files; comments are skipped."""
+        index = cls()
+        index.update(read_domains(blocked_path))
+        if allowed_path:
+            try:
+                index.update_allowed(read_domains(allowed_path))
+            except FileNotFoundError:
+                pass
+        return index
+
+
+def domain_hash(domain: str) -> int:
+    """Return the 64-bit hash used by the compiled index for a normalized domain."""
+    return int.from_bytes(hashlib.blake2b(domain.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _hash_array(domains: Iterable[str]) -> array:
+    hashes = array('Q', sorted({domain_hash(normalize_domain(d)) for d in domains if d.strip()}))
+    if sys.byteorder == 'big':
+        hashes.byteswap()
+    return hashes
+
+
+def write_compiled_index(path: str, blocked: Iterable[str], allowed: Iterable[str] = ()):
+    """Write a compiled index of sorted domain hashes.
+
+    The file is written next to `path` and renamed over it, so servers that
+    still have the old index mapped keep reading a consistent file.
+    """
+    blocked_hashes = _hash_array(blocked)
+    allowed_hashes = _hash_array(allowed)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, len(blocked_hashes), len(allowed_hashes)))
+        blocked_hashes.tofile(f)
+        allowed_hashes.tofile(f)
+    os.replace(tmp_path, path)
+
+
+class CompiledBlocklist:
+    """Read-only blocklist queried in place from a memory-mapped compiled index.
+
+    Opening the index costs one mmap call regardless of its size, and every
+    process that maps the file shares the same page-cache pages. Lookups use
+    the same most-specific-rule-wins suffix walk as BlocklistIndex, with a
+    binary search over 64-bit domain hashes per label. With 64-bit hashes the
+    chance of a false match is negligible for lists of millions of domains.
+    The mapped file is never modified; deltas are kept in small overlay sets
+    of added and removed hashes until the next full reload.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, blocked_count, allowed_count = INDEX_HEADER.unpack_from(self._mmap, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{path} is not a compiled blocklist index")
+        start = INDEX_HEADER.size
+        middle = start + 8 * blocked_count
+        end = middle + 8 * allowed_count
+        if len(self._mmap) < end:
+            raise ValueError(f"{path} is truncated")
+        view = memoryview(self._mmap)
+        if sys.byteorder == 'little':
+            self.blocked = view[start:middle].cast('Q')
+            self.allowed = view[middle:end].cast('Q')
+        else:
+            # Big-endian hosts cannot use the file in place; fall back to swapped copies
+            self.blocked = array('Q', view[start:middle])
+            self.blocked.byteswap()
+            self.allowed = array('Q', view[middle:end])
+            self.allowed.byteswap()
+        self.added_hashes = set()
+        self.removed_hashes = set()
+
+    def __len__(self) -> int:
+        return len(self.blocked) + len(self.added_hashes) - len(self.removed_hashes)
+
+    @staticmethod
+    def _contains(hashes, value: int) -> bool:
+        index = bisect.bisect_left(hashes, value)
+        return index < len(hashes) and hashes[index] == value
+
+    def match(self, domain: str, hashes: Sequence[int] = (), clear: int = 0) -> Optional[str]:
+        """Return the most specific rule matching a domain, or None.
+
+        `hashes` may hold the domain hashes of the name and its parents, most
+        specific first, as a prefilter already computed them. The first
+        `clear` of those names are known not to be blocked, so only the
+        allowlist is searched for them.
+        """
+        name = normalize_domain(domain)
+        allowed = self.allowed
+        added = self.added_hashes
+        removed = self.removed_hashes
+        known = len(hashes)
+        position = 0
+        while name:
+            value = hashes[position] if position < known else domain_hash(name)
+            if allowed and self._contains(allowed, value):
+                return None
+            if position >= clear and (value in added or
+                                      (self._contains(self.blocked, value) and value not in removed)):
+                return name
+            position += 1
+            dot = name.find('.')
+            if dot < 0:
+                break
+            name = name[dot + 1:]
+        return None
+
+    def is_blocked(self, domain: str) -> bool:
+        """Check whether a domain or one of its parents is blocked."""
+        return self.match(domain) is not None
+
+    def apply_delta(self, added: Iterable[str], removed: Iterable[str]):
+        """Add and remove block rules in the overlay sets."""
+        for domain in removed:
+            value = domain_hash(normalize_domain(domain))
+            if value in self.added_hashes:
+                self.added_hashes.discard(value)
+            elif self._contains(self.blocked, value):
+                self.removed_hashes.add(value)
+        for domain in added:
+            value = domain_hash(normalize_domain(domain))
+            if value in self.removed_hashes:
+                self.removed_hashes.discard(value)
+            elif not self._contains(self.blocked, value):
+                self.added_hashes.add(value)
+
+
+def read_generation(path: str) -> int:
+    """Return the generation recorded in a blocklist file's header, 0 if it has none."""
+    try:
+        with open(path, 'r') as f:
+            first = f.readline()
+    except FileNotFoundError:
+        return 0
+    if first.startswith(GENERATION_PREFIX):
+        try:
+            return int(first[len(GENERATION_PREFIX):])
+        except ValueError:
+            pass
+    return 0
+
+
+def write_delta(path: str, delta: BlocklistDelta):
+    """Write a blocklist delta as JSON, replacing the previous one atomically."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(delta._asdict(), f)
+    os.replace(tmp_path, path)
+
+
+def read_delta(path: str) -> Optional[BlocklistDelta]:
+    """Read a delta written by `write_delta`, or None if it is missing or invalid."""
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+        return BlocklistDelta(int(data['generation']), int(data['base_generation']),
+                              list(data['added']), list(data['removed']))
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Ignoring invalid blocklist delta {path}: {str(e)}")
+        return None
+
+
+def read_domains(path: str):
+    """Yield the domains of a one-per-line file, skipping comments."""
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
@@ -0,0 +1,158 @@
+import ipaddress
+import re
+from typing import Iterable, Iterator, List, Optional
+
+from blocklist_index import normalize_domain
+
+CHUNK_SIZE = 64 * 1024
+
+# Names that hosts files map to loopback for the machine itself, not ad domains
+HOSTS_FILE_NAMES = {
+    'localhost', 'localhost.localdomain', 'local', 'broadcasthost',
+    'ip6-localhost', 'ip6-loopback', 'ip6-localnet', 'ip6-mcastprefix',
+    'ip6-allnodes', 'ip6-allrouters', 'ip6-allhosts',
+}
+
+# Addresses nearly every hosts-format list maps its entries to
+COMMON_ADDRESSES = {'0.0.0.0', '127.0.0.1', '::', '::1'}
+
+# Letters, digits, hyphens and underscores (used by some tracking hosts), 1-63 per label
+HOSTNAME_PATTERN = re.compile(r'(?:[a-z0-9_](?:[a-z0-9_-]{0,61}[a-z0-9_])?\.)+'
+                              r'[a-z0-9_](?:[a-z0-9_-]{0,61}[a-z0-9_])?')
+
+
+def is_address(text: str) -> bool:
+    """Check whether a hosts-file token is an IPv4 or IPv6 address."""
+    if text in COMMON_ADDRESSES:
+        return True
+    try:
+        ipaddress.ip_address(text.split('%', 1)[0])
+        return True
+    except ValueError:
+        return False
+
+
+def normalize_hostname(name: str) -> Optional[str]:
+    """Return a hostname in lower-case IDNA form without a trailing dot, or None if invalid.
+
+    Single-label names are rejected: in a downloaded list they are either
+    local host names or would block a whole top-level domain.
+    """
+    name = normalize_domain(name)
+    if not name.isascii():
+        try:
+            name = name.encode('idna').decode('ascii')
+        except UnicodeError:
+            return None
+    if len(name) > 253 or name in HOSTS_FILE_NAMES or not HOSTNAME_PATTERN.fullmatch(name):
+        return None
+    # No top-level domain is numeric, so this rejects IPv4 addresses like `0.0.0.0`
+    if name.rsplit('.', 1)[-1].isdigit():
+        return None
+    return name
+
+
+def parse_line(line: str) -> List[str]:
+    """Return the normalized domains listed on one line of a hosts or bare-domain list.
+
+    Accepts `0.0.0.0 ads.example.com [more names]`, `ads.example.com` and
+    either form with a trailing `# comment`.
+    """
+    line = line.split('#', 1)[0]
+    parts = line.split()
+    if not parts:
+        return []
+    if is_address(parts[0]):
+        names = parts[1:]
+    elif len(parts) == 1:
+        names = parts
+    else:
+        return []
+    domains = []
+    for name in names:
+        domain = normalize_hostname(name)
+        if domain:
+            domains.append(domain)
+    return domains
+
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    """Split a stream of byte chunks into decoded lines, holding at most one partial line."""
+    pending = b''
+    for chunk in chunks:
+        if not chunk:
+            continue
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line.decode('utf-8', 'replace')
+    if pending:
+        yield pending.decode('utf-8', 'replace')
+
+
+def parse_hosts(chunks: Iterable[bytes]) -> Iterator[str]:
+    """Yield the normalized domains of a hosts or bare-domain list read in chunks."""
+    for line in iter_lines(chunks):
+        yield from parse_line(line)
+
+
+def read_file_chunks(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield the contents of a local file in chunks."""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+class BlocklistBuilder:
+    """Merges block rules from several sources, dropping rules a parent already covers.
+
+    A rule is redundant when a parent domain is blocked and no allowlist
+    entry sits between the two; with `tracker.com` listed,
+    `ads.tracker.com` adds nothing. Sources are merged one at a time and
+    `prune` removes children whose parent only arrived in a later source.
+    """
+
+    def __init__(self, allowed: Iterable[str] = ()):
+        self.domains = set()
+        self.allowed = {normalize_domain(domain) for domain in allowed}
+        self.skipped = 0
+
+    def __len__(self) -> int:
+        return len(self.domains)
+
+    def covered(self, domain: str) -> bool:
+        """Check whether a parent rule of `domain` already blocks it."""
+        name = domain
+        dot = name.find('.')
+        while dot >= 0:
+            name = name[dot + 1:]
+            if name in self.allowed:
+                return False
+            if name in self.domains:
+                return True
+            dot = name.find('.')
+        return False
+
+    def add(self, domain: str):
+        """Add a normalized domain unless a parent rule covers it."""
+        if domain in self.domains:
+            return
+        if self.covered(domain):
+            self.skipped += 1
+        else:
+            self.domains.add(domain)
+
+    def update(self, domains: Iterable[str]):
+        """Add several normalized domains."""
+        for domain in domains:
+            self.add(domain)
+
+    def prune(self) -> int:
+        """Remove rules covered by a parent added after them; return how many were removed."""
+        redundant = [domain for domain in self.domains if self.covered(domain)]
+        self.domains.difference_update(redundant)
+        self.skipped += len(redundant)
+        return len(redundant)
@@ -0,0 +1,196 @@
+import math
+import os
+import struct
+from typing import Iterable, List, Optional, Set, Tuple
+
+from blocklist_index import CompiledBlocklist, domain_hash, normalize_domain
+
+# File layout: magic, number of bits, number of hash functions, length of the
+# newline-separated top-level rules, then those rules and the bit array
+BLOOM_MAGIC = b'BLOOM001'
+BLOOM_HEADER = struct.Struct('<8sQII')
+
+# Names with a dot probed by a typical query: its own name and every parent
+# but the TLD, e.g. three for ads.example.co.uk. The false-positive rate asked
+# for is per query, so each probe gets a smaller share of it.
+SUFFIX_PROBES = 3
+# Every hash function is a bit test in Python, and hits test all of them.
+# Past four, fewer bits buy too little for the slower hits and misses.
+MAX_HASHES = 4
+
+
+class BloomFilter:
+    """Bloom filter over the 64-bit domain hashes of the compiled index.
+
+    The k bit positions are derived from one 64-bit hash by double hashing,
+    so a probe costs one blake2b call however many hash functions are used.
+    Single-label rules are kept in an exact set instead: nearly every query
+    ends in a handful of TLDs, and a false positive on `com` would send all
+    of them to the exact index.
+    """
+
+    def __init__(self, num_bits: int, num_hashes: int, bits: Optional[bytearray] = None,
+                 top_level: Optional[Set[str]] = None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+        self.top_level = top_level if top_level is not None else set()
+
+    @classmethod
+    def for_capacity(cls, capacity: int, fp_rate: float = 0.01,
+                     probes: int = SUFFIX_PROBES) -> 'BloomFilter':
+        """Create a filter sized for `capacity` entries.
+
+        `fp_rate` is the false-positive rate of a query that makes `probes`
+        probes, so each probe is sized for 1 - (1 - fp_rate) ** (1 / probes).
+        """
+        if not 0 < fp_rate < 1:
+            raise ValueError(f"False-positive rate must be between 0 and 1, got {fp_rate}")
+        capacity = max(1, capacity)
+        probe_rate = 1 - (1 - fp_rate) ** (1 / max(1, probes))
+        num_bits = max(8, math.ceil(-capacity * math.log(probe_rate) / math.log(2) ** 2))
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        if num_hashes > MAX_HASHES:
+            # Same rate with fewer hash functions: (1 - e^(-k n / m)) ** k = probe_rate, solved for m
+            num_hashes = MAX_HASHES
+            num_bits = math.ceil(-num_hashes * capacity / math.log(1 - probe_rate ** (1 / num_hashes)))
+        return cls(num_bits, num_hashes)
+
+    @classmethod
+    def from_domains(cls, domains: Iterable[str], capacity: int, fp_rate: float = 0.01,
+                     probes: int = SUFFIX_PROBES) -> 'BloomFilter':
+        """Build a filter holding every domain in `domains`."""
+        bloom = cls.for_capacity(capacity, fp_rate, probes)
+        for domain in domains:
+            bloom.add(domain)
+        return bloom
+
+    def add_hash(self, value: int):
+        bits = self.bits
+        num_bits = self.num_bits
+        position = value & 0xFFFFFFFF
+        step = (value >> 32) | 1
+        for _ in range(self.num_hashes):
+            position %= num_bits
+            bits[position >> 3] |= 1 << (position & 7)
+            position += step
+
+    def contains_hash(self, value: int) -> bool:
+        # Misses usually stop at the first or second clear bit
+        bits = self.bits
+        num_bits = self.num_bits
+        position = value & 0xFFFFFFFF
+        step = (value >> 32) | 1
+        for _ in range(self.num_hashes):
+            position %= num_bits
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+            position += step
+        return True
+
+    def add(self, domain: str):
+        """Add a domain."""
+        domain = normalize_domain(domain)
+        if '.' in domain:
+            self.add_hash(domain_hash(domain))
+        elif domain:
+            self.top_level.add(domain)
+
+    def __contains__(self, domain: str) -> bool:
+        domain = normalize_domain(domain)
+        if '.' not in domain:
+            return domain in self.top_level
+        return self.contains_hash(domain_hash(domain))
+
+    def probe(self, name: str) -> Optional[Tuple[List[int], int]]:
+        """Probe a normalized name and its parents, most specific first.
+
+        Returns None if none of them can be in the filter. Otherwise returns
+        the domain hashes computed up to the first name that may be in it,
+        and how many of those names are definitely not in it, so the exact
+        index does not hash or search them again.
+        """
+        hashes = []
+        dot = name.find('.')
+        while dot >= 0:
+            value = domain_hash(name)
+            hashes.append(value)
+            if self.contains_hash(value):
+                return hashes, len(hashes) - 1
+            name = name[dot + 1:]
+            dot = name.find('.')
+        if name in self.top_level:
+            return hashes, len(hashes)
+        return None
+
+    def might_match(self, domain: str) -> bool:
+        """Return False if neither the domain nor any parent can be in the filter."""
+        return self.probe(normalize_domain(domain)) is not None
+
+    def save(self, path: str):
+        """Write the filter next to `path` and rename it over the old one."""
+        top_level = '\n'.join(sorted(self.top_level)).encode('utf-8')
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(BLOOM_HEADER.pack(BLOOM_MAGIC, self.num_bits, self.num_hashes, len(top_level)))
+            f.write(top_level)
+            f.write(self.bits)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'BloomFilter':
+        """Read a filter written by `save`."""
+        with open(path, 'rb') as f:
+            header = f.read(BLOOM_HEADER.size)
+            if len(header) < BLOOM_HEADER.size:
+                raise ValueError(f"{path} is not a Bloom filter")
+            magic, num_bits, num_hashes, top_level_size = BLOOM_HEADER.unpack(header)
+            top_level = f.read(top_level_size).decode('utf-8')
+            bits = bytearray(f.read())
+        if magic != BLOOM_MAGIC or len(bits) < (num_bits + 7) // 8:
+            raise ValueError(f"{path} is not a Bloom filter")
+        return cls(num_bits, num_hashes, bits, set(filter(None, top_level.split('\n'))))
+
+
+class PrefilteredBlocklist:
+    """Compiled blocklist whose lookups first ask a Bloom filter of the blocked domains.
+
+    Most queries are for domains that are not blocked; the filter answers
+    "definitely not blocked" for them without a binary search of the index.
+    Each name is hashed once, and the hashes are handed on to the index. Only
+    block rules go into the filter: an allowlist entry can only matter when a
+    block rule matches too, and then the exact index decides. The in-memory
+    BlocklistIndex answers from a hash set faster than the filter can, so
+    only the compiled index is worth wrapping.
+    """
+
+    def __init__(self, index: CompiledBlocklist, bloom: BloomFilter):
+        self.index = index
+        self.bloom = bloom
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def allowed(self):
+        return self.index.allowed
+
+    def match(self, domain: str) -> Optional[str]:
+        """Return the most specific rule matching a domain, or None."""
+        name = normalize_domain(domain)
+        probed = self.bloom.probe(name)
+        if probed is None:
+            return None
+        hashes, clear = probed
+        return self.index.match(name, hashes, clear)
+
+    def is_blocked(self, domain: str) -> bool:
+        """Check whether a domain or one of its parents is blocked."""
+        return self.match(domain) is not None
+
+    def apply_delta(self, added: Iterable[str], removed: Iterable[str]):
+        """Apply a delta to the index; removed rules stay in the filter as false positives."""
+        added = list(added)
+        for domain in added:
+            self.bloom.add(domain)
+        self.index.apply_delta(added, removed)
@@ -0,0 +1,109 @@
+import json
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+
+class CompanyClassifier:
+    """Maps domains to companies by keyword, using an Aho-Corasick automaton.
+
+    All keywords are matched in one scan of the domain, so the cost does not
+    grow with the size of the company table. When several keywords occur,
+    the longest one wins, then the one that starts first, then the company
+    name in alphabetical order, so the result never depends on the order of
+    the table. Results are memoized, since logs repeat the same domains.
+    """
+
+    def __init__(self, companies: Dict[str, List[str]], default: str = 'other',
+                 cache_size: int = 100000):
+        self.default = default
+        self.cache_size = cache_size
+        self._cache = {}
+        # Trie transitions, failure links and the best keyword ending at each node
+        self._goto = [{}]
+        self._fail = [0]
+        self._best: List[Optional[Tuple[int, str]]] = [None]
+        for company, keywords in companies.items():
+            for keyword in keywords:
+                self._add_keyword(keyword.lower(), company)
+        self._build_links()
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> 'CompanyClassifier':
+        """Load a `{"company": ["keyword", ...]}` JSON table."""
+        with open(path, 'r') as f:
+            companies = json.load(f)
+        if not isinstance(companies, dict):
+            raise ValueError(f"{path} must map company names to keyword lists")
+        return cls(companies, **kwargs)
+
+    def _add_keyword(self, keyword: str, company: str):
+        if not keyword:
+            return
+        node = 0
+        for char in keyword:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._best.append(None)
+            node = next_node
+        self._best[node] = self._better(self._best[node], (len(keyword), company))
+
+    @staticmethod
+    def _better(current: Optional[Tuple[int, str]], candidate: Tuple[int, str]) -> Tuple[int, str]:
+        # Longer keywords first, then alphabetical company names
+        if current is None or (-candidate[0], candidate[1]) < (-current[0], current[1]):
+            return candidate
+        return current
+
+    def _build_links(self):
+        """Compute failure links breadth-first and fold shorter suffix matches into each node."""
+        # Children of the root fail back to the root, which is where they start
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                suffix_best = self._best[self._fail[child]]
+                if suffix_best is not None and self._best[child] is None:
+                    self._best[child] = suffix_best
+                queue.append(child)
+
+    def classify(self, domain: str) -> str:
+        """Return the company owning a domain, or the default."""
+        company = self._cache.get(domain)
+        if company is None:
+            company = self._scan(domain.lower())
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[domain] = company
+        return company
+
+    def __getstate__(self):
+        # The memo is rebuilt by each copy; sending it to worker processes would cost more than it saves
+        state = self.__dict__.copy()
+        state['_cache'] = {}
+        return state
+
+    def _scan(self, text: str) -> str:
+        goto = self._goto
+        fail = self._fail
+        best = self._best
+        node = 0
+        found = None  # (length, start, company) of the best match so far
+        for end, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            match = best[node]
+            if match is not None:
+                length, company = match
+                key = (-length, end - length + 1, company)
+                if found is None or key < found:
+                    found = key
+        return found[2] if found else self.default
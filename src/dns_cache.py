@@ -0,0 +1,113 @@
+import struct
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import List, Optional, Tuple
+
+from dns_wire import (FLAG_TC, TYPE_OPT, TYPE_SOA, DNSParseError, iter_records,
+                      parse_header, skip_questions)
+
+RCODE_NOERROR = 0
+RCODE_NXDOMAIN = 3
+
+CacheKey = Tuple[str, int, int]
+
+
+def response_ttls(response: bytes) -> Tuple[Optional[int], List[Tuple[int, int]]]:
+    """Work out how long a response may be cached.
+
+    Returns the cache TTL (None if the response must not be cached) and the
+    offset and original value of every record TTL, so hits can be served with
+    the remaining time. Negative answers (NXDOMAIN and NODATA) are cached for
+    the SOA TTL capped by the SOA MINIMUM field, as described in RFC 2308.
+    """
+    header = parse_header(response)
+    rcode = header.flags & 0x000F
+    if header.flags & FLAG_TC or rcode not in (RCODE_NOERROR, RCODE_NXDOMAIN):
+        return None, []  # Truncated or failed answers are not cached
+
+    offset = skip_questions(response, header.qdcount)
+    ttls = []
+    answer_ttl = None
+    negative_ttl = None
+    records = iter_records(response, offset, header.ancount + header.nscount + header.arcount)
+    for index, record in enumerate(records):
+        if record.rtype == TYPE_OPT:
+            continue  # The OPT "TTL" holds EDNS flags
+        ttls.append((record.ttl_offset, record.ttl))
+        if index < header.ancount:
+            answer_ttl = record.ttl if answer_ttl is None else min(answer_ttl, record.ttl)
+        elif index < header.ancount + header.nscount and record.rtype == TYPE_SOA:
+            # MINIMUM is the last 32-bit field of the SOA RDATA
+            rdata_end = record.rdata_offset + record.rdlength
+            minimum = struct.unpack('!I', response[rdata_end - 4:rdata_end])[0]
+            negative_ttl = min(record.ttl, minimum)
+
+    if rcode == RCODE_NOERROR and header.ancount:
+        return answer_ttl, ttls
+    return negative_ttl, ttls
+
+
+class DNSCache:
+    """Bounded LRU cache of upstream responses keyed by (qname, qtype, qclass).
+
+    Entries expire after the smallest record TTL. Hits are returned with
+    record TTLs reduced by the time spent in the cache.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_ttl: int = 86400):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.entries = OrderedDict()
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: CacheKey, query: bytes, question_end: int) -> Optional[bytes]:
+        """Return a cached response rewritten for a query, or None on a miss.
+
+        The transaction ID and the question (whose letter case may differ from
+        the cached one) are copied from the query.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats['cache_misses'] += 1
+                return None
+            response, stored_at, expires, ttls = entry
+            if now >= expires:
+                del self.entries[key]
+                self.stats['cache_expired'] += 1
+                self.stats['cache_misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['cache_hits'] += 1
+
+        reply = bytearray(response)
+        reply[0:2] = query[0:2]
+        reply[12:question_end] = query[12:question_end]
+        elapsed = int(now - stored_at)
+        if elapsed:
+            for offset, ttl in ttls:
+                struct.pack_into('!I', reply, offset, max(0, ttl - elapsed))
+        return bytes(reply)
+
+    def put(self, key: CacheKey, response: bytes):
+        """Store an upstream response if it is cacheable."""
+        try:
+            ttl, ttls = response_ttls(response)
+        except (DNSParseError, struct.error):
+            return  # Malformed responses are passed through but not cached
+        if not ttl:
+            return
+        now = time.monotonic()
+        entry = (response, now, now + min(ttl, self.max_ttl), ttls)
+        with self._lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['cache_evictions'] += 1
@@ -2,11 +2,24 @@ import socket
 import struct
 import time
 import logging
-from datetime import datetime
-from typing import Dict, List, Tuple
-import json
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import multiprocessing
 import os
+import queue
+import signal
+import threading
 import traceback
+from batch_io import serve_batched
+from blocklist_index import (BlocklistIndex, CompiledBlocklist, read_delta, read_domains,
+                             read_generation)
+from bloom_filter import BloomFilter, PrefilteredBlocklist
+from dns_cache import CacheKey, DNSCache
+from dns_wire import CLASS_IN, TYPE_A, TYPE_AAAA, DNSParseError, Question, parse_query, read_name
+from request_log import BlockedRequestLog, worker_log_path
+from upstream import AsyncUpstreamPool, UpstreamPool, parse_upstream
 
 # Configure logging
 logging.basicConfig(
@@ -15,64 +28,223 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Answer records for blocked queries, appended after the copied question:
+# name pointer to the question, type, class IN, TTL 300 and an all-zero address
+BLOCKED_ANSWERS = {
+    TYPE_A: struct.pack('!HHHIH', 0xC000 | 12, TYPE_A, CLASS_IN, 300, 4) + bytes(4),        # 0.0.0.0
+    TYPE_AAAA: struct.pack('!HHHIH', 0xC000 | 12, TYPE_AAAA, CLASS_IN, 300, 16) + bytes(16),  # ::
+}
+# QDCOUNT, ANCOUNT, NSCOUNT and ARCOUNT of a blocked answer, without and with an answer record
+BLOCKED_COUNTS = {
+    False: struct.pack('!HHHH', 1, 0, 0, 0),
+    True: struct.pack('!HHHH', 1, 1, 0, 0),
+}
+RCODE_SERVFAIL = 2
+
+def format_counters(counters: Dict[str, int]) -> str:
+    """Format server counters for the log."""
+    text = (f"{counters.get('queries', 0)} queries, {counters.get('blocked', 0)} blocked, "
+            f"{counters.get('forwarded', 0)} forwarded, "
+            f"{counters.get('upstream_failures', 0)} upstream failures, "
+            f"{counters.get('malformed', 0)} malformed, {counters.get('errors', 0)} errors")
+    if 'cache_hits' in counters or 'cache_misses' in counters:
+        text += (f", cache {counters.get('cache_hits', 0)} hits / "
+                 f"{counters.get('cache_misses', 0)} misses / "
+                 f"{counters.get('cache_evictions', 0)} evictions")
+    return text
+
 class DNSServer:
-    def __init__(self, host: str = '0.0.0.0', port: int = 53):
+    def __init__(self, host: str = '0.0.0.0', port: int = 53,
+                 upstreams: Optional[List[Tuple[str, int]]] = None,
+                 upstream_timeout: float = 1.0, cache_size: int = 10000,
+                 use_prefilter: bool = False):
         self.host = host
         self.port = port
-        self.blocked_domains = set()
-        self.blocked_requests = []
+        # Non-blocked queries are forwarded upstream; without upstreams they get an empty answer
+        self.upstream = UpstreamPool(upstreams, timeout=upstream_timeout) if upstreams else None
+        # The asyncio front-end waits for upstream replies on the event loop instead
+        self.async_upstream = (AsyncUpstreamPool(self.upstream.upstreams, timeout=upstream_timeout)
+                               if self.upstream else None)
+        # Forwarded answers are cached; blocked answers are cheap to build locally
+        self.cache = DNSCache(cache_size) if self.upstream and cache_size > 0 else None
+        self.blocked_domains_path = 'blocked_domains.txt'
+        self.allowed_domains_path = 'allowed_domains.txt'
+        # Written by update_blocklist.py; used instead of the text files when it is up to date
+        self.compiled_index_path = 'blocked_domains.idx'
+        # Optional Bloom filter asked before the exact index; mostly answers "not blocked"
+        self.use_prefilter = use_prefilter
+        self.bloom_filter_path = 'blocked_domains.bloom'
+        self.prefilter_fp_rate = 0.01  # Used when the filter has to be built at load time
+        # Changes since the previous generation, applied in place instead of a full reload
+        self.delta_path = 'blocked_domains.delta'
+        self.blocklist = BlocklistIndex()
+        self.generation = 0
+        self.loaded_state = None  # blocklist_state() of the files behind the live index
+        self.watch_interval = 0.0  # Seconds between blocklist file checks; 0 disables watching
+        self._reload_lock = threading.Lock()
+        self.request_log = BlockedRequestLog()
+        self.stats = Counter()
+        self.stats_interval = 10.0  # Seconds between worker counter reports
+        self.use_asyncio = False
+        self.batch_size = 1  # Datagrams drained per wakeup by the batched loop
         self.load_blocked_domains()
         
+    def compiled_index_is_current(self) -> bool:
+        """Check whether the compiled index exists and is not older than the text files."""
+        index_mtime, blocked_mtime, allowed_mtime, _ = self.blocklist_mtimes()
+        return index_mtime > 0 and index_mtime >= max(blocked_mtime, allowed_mtime)
+
+    def build_prefilter(self, blocklist: CompiledBlocklist) -> BloomFilter:
+        """Load the Bloom filter written by update_blocklist.py, or build one from `blocklist`."""
+        _, blocked_mtime, _, bloom_mtime = self.blocklist_mtimes()
+        if bloom_mtime > 0 and bloom_mtime >= blocked_mtime:
+            return BloomFilter.load(self.bloom_filter_path)
+        logger.info("Bloom filter missing or out of date, building it from the blocklist")
+        # The compiled index only holds hashes, so its filter is built from the text file
+        return BloomFilter.from_domains(read_domains(self.blocked_domains_path), len(blocklist),
+                                        self.prefilter_fp_rate)
+
+    def build_blocklist(self):
+        """Open the compiled index if it is current, else index the text files.
+
+        With the prefilter enabled the compiled index is wrapped together
+        with its Bloom filter, so both are swapped in by the same assignment.
+        The in-memory index is faster without the filter and is never wrapped.
+        """
+        if not self.compiled_index_is_current():
+            return BlocklistIndex.from_files(self.blocked_domains_path, self.allowed_domains_path)
+        blocklist = CompiledBlocklist(self.compiled_index_path)
+        if self.use_prefilter:
+            try:
+                return PrefilteredBlocklist(blocklist, self.build_prefilter(blocklist))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Bloom prefilter unavailable, using the exact index only: {str(e)}")
+        return blocklist
+
     def load_blocked_domains(self):
-        """Load the list of blocked domains from a file."""
+        """Load the blocked domains and allowlist exceptions from files.
+
+        A listed domain also blocks all of its subdomains. Entries in
+        `allowed_domains.txt` override block rules for that domain and its
+        subdomains.
+        """
         try:
-            with open('blocked_domains.txt', 'r') as f:
-                self.blocked_domains = set(line.strip() for line in f)
-            logger.info(f"Loaded {len(self.blocked_domains)} blocked domains")
+            state = self.blocklist_state()
+            self.blocklist = self.build_blocklist()
+            self.generation, self.loaded_state = state[0], state
+            logger.info(f"Loaded {len(self.blocklist)} blocked domains "
+                        f"and {len(self.blocklist.allowed)} allowed domains "
+                        f"(generation {self.generation})")
         except FileNotFoundError:
             logger.warning("No blocked domains file found. Creating empty list.")
-            self.blocked_domains = set()
+            self.blocklist = BlocklistIndex()
+
+    def blocklist_state(self) -> Tuple[int, float, float]:
+        """Return the generation of the blocked domains file and the text files' mtimes."""
+        _, blocked_mtime, allowed_mtime, _ = self.blocklist_mtimes()
+        return read_generation(self.blocked_domains_path), blocked_mtime, allowed_mtime
+
+    def apply_delta(self, state: Tuple[int, float, float]) -> bool:
+        """Apply the delta file to the live blocklist if it leads from its generation to `state`.
+
+        Returns False when a full reload is needed instead: the delta is
+        missing or skips a generation, or the allowlist changed.
+        """
+        delta = read_delta(self.delta_path)
+        if (delta is None or self.loaded_state is None
+                or delta.base_generation != self.generation
+                or delta.generation != state[0]
+                or state[2] != self.loaded_state[2]):
+            return False
+        start = time.monotonic()
+        self.blocklist.apply_delta(delta.added, delta.removed)
+        self.generation, self.loaded_state = delta.generation, state
+        logger.info(f"Applied blocklist delta {delta.base_generation} -> {delta.generation} "
+                    f"(+{len(delta.added)} / -{len(delta.removed)} domains) "
+                    f"in {(time.monotonic() - start) * 1000:.1f}ms")
+        return True
+
+    def reload_blocked_domains(self):
+        """Bring the blocklist up to date with its files.
+
+        If update_blocklist.py left a delta from the loaded generation to the
+        current one, it is applied to the live index in place. Otherwise the
+        index is rebuilt while queries keep using the old one, and swapped in
+        by a single attribute assignment, so no lookup ever sees a half-built
+        index. A reload requested while one is running is skipped.
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            logger.info("Blocklist reload already in progress")
+            return
+        try:
+            state = self.blocklist_state()
+            if state == self.loaded_state:
+                logger.info(f"Blocklist already at generation {self.generation}")
+                return
+            if self.apply_delta(state):
+                return
+            start = time.monotonic()
+            blocklist = self.build_blocklist()
+            self.blocklist = blocklist
+            self.generation, self.loaded_state = state[0], state
+            logger.info(f"Reloaded {len(blocklist)} blocked domains and "
+                        f"{len(blocklist.allowed)} allowed domains "
+                        f"(generation {self.generation}) in {time.monotonic() - start:.2f}s")
+        except Exception as e:
+            logger.error(f"Blocklist reload failed, keeping the old list: {str(e)}")
+        finally:
+            self._reload_lock.release()
+
+    def request_reload(self):
+        """Reload the blocklist on a background thread."""
+        threading.Thread(target=self.reload_blocked_domains, name='blocklist-reload',
+                         daemon=True).start()
+
+    def blocklist_mtimes(self) -> Tuple[float, float, float, float]:
+        """Return the modification times of the blocklist files (0 if missing)."""
+        mtimes = []
+        for path in (self.compiled_index_path, self.blocked_domains_path,
+                     self.allowed_domains_path, self.bloom_filter_path):
+            try:
+                mtimes.append(os.stat(path).st_mtime)
+            except FileNotFoundError:
+                mtimes.append(0.0)
+        return tuple(mtimes)
+
+    def watch_blocklist(self):
+        """Poll the blocklist files and reload them when they change."""
+        last = self.blocklist_mtimes()
+        while True:
+            time.sleep(self.watch_interval)
+            current = self.blocklist_mtimes()
+            if current != last:
+                last = current
+                logger.info("Blocklist files changed, reloading")
+                self.reload_blocked_domains()
+
+    def install_reload_triggers(self):
+        """Reload the blocklist on SIGHUP and, if enabled, when its files change."""
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda signum, frame: self.request_reload())
+        if self.watch_interval > 0:
+            threading.Thread(target=self.watch_blocklist, name='blocklist-watch',
+                             daemon=True).start()
 
     def save_blocked_request(self, domain: str):
         """Save information about a blocked request."""
-        timestamp = datetime.now().isoformat()
-        self.blocked_requests.append({
-            'timestamp': timestamp,
-            'domain': domain
-        })
-        
-        # Save to file periodically
-        if len(self.blocked_requests) % 10 == 0:
-            self.write_blocked_requests()
-
-    def write_blocked_requests(self):
-        """Write blocked requests to a file."""
-        with open('blocked_requests.json', 'w') as f:
-            json.dump(self.blocked_requests, f, indent=2)
+        self.request_log.log(domain)
 
     def parse_domain(self, data: bytes, offset: int) -> Tuple[str, int]:
         """Parse a domain name from DNS packet."""
-        domain = []
-        while True:
-            length = data[offset]
-            if length == 0:
-                break
-            if length & 0xC0 == 0xC0:  # Handle DNS compression
-                pointer = struct.unpack('!H', data[offset:offset+2])[0] & 0x3FFF
-                domain.append(self.parse_domain(data, pointer)[0])
-                offset += 2
-                break
-            offset += 1
-            domain.append(data[offset:offset+length].decode())
-            offset += length
-        return '.'.join(domain), offset + 1
-
-    def create_response(self, query_id: int, domain: str, is_blocked: bool) -> bytes:
+        name, offset = read_name(data, offset)
+        return name.decode('latin-1'), offset
+
+    def create_response(self, query_id: int, domain: str, is_blocked: bool, rcode: int = 0) -> bytes:
         """Create a DNS response packet."""
         # DNS header
         response = struct.pack('!HHHHHH', 
             query_id,  # ID
-            0x8180,    # Flags (Standard query response, No error)
+            0x8180 | rcode,  # Flags (Standard query response, No error unless rcode is set)
             1,         # Questions
             1 if is_blocked else 0,  # Answer RRs
             0,         # Authority RRs
@@ -96,51 +268,424 @@ class DNSServer:
 
         return response
 
+    def check_query(self, data: bytes) -> Tuple[int, str, Question, bool]:
+        """Parse a query and check its domain against the blocklist."""
+        header, question = parse_query(data)
+        # latin-1 maps every byte to one character, so odd labels cannot fail to decode
+        domain = question.qname.decode('latin-1')
+
+        is_blocked = self.blocklist.is_blocked(domain)
+        if is_blocked:
+            self.stats['blocked'] += 1
+            logger.info(f"Blocked request for domain: {domain}")
+            self.save_blocked_request(domain)
+        return header.id, domain, question, is_blocked
+
+    def cache_key(self, domain: str, question: Question) -> CacheKey:
+        """Build the (qname, qtype, qclass) cache key of a query."""
+        return domain, question.qtype, question.qclass
+
+    def cached_response(self, key: CacheKey, data: bytes, question_end: int) -> Optional[bytes]:
+        """Return a cached answer for a query, if there is one."""
+        if self.cache is None:
+            return None
+        return self.cache.get(key, data, question_end)
+
+    def finish_forward(self, data: bytes, question: Question, key: CacheKey,
+                       reply: Optional[bytes]) -> bytes:
+        """Return an upstream reply, or SERVFAIL if no upstream answered."""
+        if reply is None:
+            self.stats['upstream_failures'] += 1
+            return self.create_error_response(data, question, RCODE_SERVFAIL)
+        self.stats['forwarded'] += 1
+        if self.cache is not None:
+            self.cache.put(key, reply)
+        return reply
+
+    def counters(self) -> Dict[str, int]:
+        """Return the query counters together with the cache counters."""
+        counters = Counter(self.stats)
+        if self.cache is not None:
+            counters.update(self.cache.stats)
+        return dict(counters)
+
+    def create_blocked_response(self, data: bytes, question: Question) -> bytes:
+        """Create the answer to a blocked query from the query itself.
+
+        The header and question are copied from the query and a precomputed
+        A 0.0.0.0 or AAAA :: record is appended; other query types get an
+        empty answer. Only the flags and counts are patched.
+        """
+        answer = BLOCKED_ANSWERS.get(question.qtype, b'')
+        response = bytearray(data[:question.end])
+        response += answer
+        # QR set, opcode and RD kept from the query, RA set, NOERROR
+        response[2] = 0x80 | (data[2] & 0x79)
+        response[3] = 0x80
+        response[4:12] = BLOCKED_COUNTS[bool(answer)]
+        return bytes(response)
+
+    def create_error_response(self, data: bytes, question: Question, rcode: int) -> bytes:
+        """Create an answer with no records and the given RCODE from the query itself.
+
+        Like a blocked answer, the header and question are copied verbatim,
+        so the client sees its own query type and the name as it sent it.
+        """
+        response = bytearray(data[:question.end])
+        # QR set, opcode and RD kept from the query, RA set, the given RCODE
+        response[2] = 0x80 | (data[2] & 0x79)
+        response[3] = 0x80 | rcode
+        response[4:12] = BLOCKED_COUNTS[False]
+        return bytes(response)
+
+    def answer_locally(self, data: bytes) -> Tuple[Optional[bytes], Optional[Tuple[Question, CacheKey]]]:
+        """Answer a query from the blocklist or the cache, or tell the caller to forward it.
+
+        Returns (response, None) for a query answered here, and
+        (None, (question, cache key)) for one that must go upstream.
+        """
+        query_id, domain, question, is_blocked = self.check_query(data)
+        if is_blocked:
+            return self.create_blocked_response(data, question), None
+        if self.upstream is None:
+            return self.create_response(query_id, domain, False), None
+        key = self.cache_key(domain, question)
+        cached = self.cached_response(key, data, question.end)
+        if cached:
+            return cached, None
+        return None, (question, key)
+
+    def query_failed(self, error: Exception, addr: Tuple[str, int]) -> bytes:
+        """Count a query that could not be answered; returns the empty response that drops it."""
+        if isinstance(error, DNSParseError):
+            # Malformed packets are dropped without a traceback to keep them cheap
+            self.stats['malformed'] += 1
+            logger.debug(f"Dropped malformed query from {addr}: {str(error)}")
+            return b''
+        self.stats['errors'] += 1
+        logger.error(f"Error handling query: {str(error)}")
+        logger.error(traceback.format_exc())
+        return b''
+
     def handle_query(self, data: bytes, addr: Tuple[str, int]) -> bytes:
         """Handle an incoming DNS query."""
+        self.stats['queries'] += 1
         try:
-            query_id = struct.unpack('!H', data[0:2])[0]
-            domain, _ = self.parse_domain(data, 12)
-            
-            is_blocked = domain in self.blocked_domains
-            if is_blocked:
-                logger.info(f"Blocked request for domain: {domain}")
-                self.save_blocked_request(domain)
-            
-            return self.create_response(query_id, domain, is_blocked)
+            response, forward = self.answer_locally(data)
+            if forward is None:
+                return response
+            question, key = forward
+            return self.finish_forward(data, question, key, self.upstream.forward(data))
         except Exception as e:
-            logger.error(f"Error handling query: {str(e)}")
-            logger.error(traceback.format_exc())
-            return b''
+            return self.query_failed(e, addr)
+
+    async def handle_query_async(self, data: bytes, addr: Tuple[str, int]) -> bytes:
+        """Handle an incoming DNS query without blocking the event loop."""
+        self.stats['queries'] += 1
+        try:
+            response, forward = self.answer_locally(data)
+            if forward is None:
+                return response
+            question, key = forward
+            reply = await self.async_upstream.forward(data)
+            return self.finish_forward(data, question, key, reply)
+        except Exception as e:
+            return self.query_failed(e, addr)
+
+    def log_counters(self):
+        """Log the counters of this process."""
+        logger.info(f"Counters: {format_counters(self.counters())}")
+
+    def create_socket(self, reuse_port: bool = False) -> socket.socket:
+        """Create the UDP socket the server listens on."""
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            # Every worker binds the same port; the kernel spreads datagrams between them
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server.bind((self.host, self.port))
+        return server
+
+    def serve(self, server: socket.socket, report: Optional[Callable[[], None]] = None):
+        """Answer queries on a bound socket forever.
+
+        If `report` is given, it is called every `stats_interval` seconds.
+        With `batch_size` above 1, datagrams are received and answered in
+        batches on a non-blocking socket.
+        """
+        if self.batch_size > 1:
+            serve_batched(server, self.handle_query, self.batch_size,
+                          report=report, report_interval=self.stats_interval)
+            return
+        if report:
+            server.settimeout(self.stats_interval)
+        next_report = time.monotonic() + self.stats_interval
+        while True:
+            try:
+                data, addr = server.recvfrom(512)
+                response = self.handle_query(data, addr)
+                if response:
+                    server.sendto(response, addr)
+            except socket.timeout:
+                pass
+            except Exception as e:
+                logger.error(f"Error processing request: {str(e)}")
+                logger.error(traceback.format_exc())
+            if report and time.monotonic() >= next_report:
+                report()
+                next_report = time.monotonic() + self.stats_interval
 
     def start(self):
         """Start the DNS server."""
+        server = None
         try:
-            server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            server.bind((self.host, self.port))
+            server = self.create_socket()
+            if self.upstream:
+                self.upstream.open()
+            self.install_reload_triggers()
             logger.info(f"DNS server started on {self.host}:{self.port}")
+            self.serve(server, self.log_counters)
+        except Exception as e:
+            logger.error(f"Failed to start DNS server: {str(e)}")
+            logger.error(traceback.format_exc())
+            raise
+        finally:
+            self.request_log.close()
+            if server:
+                server.close()
 
+    async def serve_async(self, reuse_port: bool = False,
+                          report: Optional[Callable[[], None]] = None):
+        """Answer queries from an asyncio event loop forever."""
+        if self.async_upstream:
+            await self.async_upstream.open()
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: DNSServerProtocol(self),
+            local_addr=(self.host, self.port),
+            reuse_port=reuse_port or None
+        )
+        try:
             while True:
-                try:
-                    data, addr = server.recvfrom(512)
-                    response = self.handle_query(data, addr)
-                    if response:
-                        server.sendto(response, addr)
-                except Exception as e:
-                    logger.error(f"Error processing request: {str(e)}")
-                    logger.error(traceback.format_exc())
+                await asyncio.sleep(self.stats_interval)
+                if report:
+                    report()
+        finally:
+            transport.close()
+            if self.async_upstream:
+                self.async_upstream.close()
+
+    def start_async(self):
+        """Start the DNS server on an asyncio event loop."""
+        try:
+            logger.info(f"DNS server (asyncio) started on {self.host}:{self.port}")
+            self.install_reload_triggers()
+            asyncio.run(self.serve_async(report=self.log_counters))
         except Exception as e:
             logger.error(f"Failed to start DNS server: {str(e)}")
             logger.error(traceback.format_exc())
             raise
         finally:
-            server.close()
+            self.request_log.close()
+
+    def run_worker(self, worker_id: int, stats_queue: multiprocessing.Queue):
+        """Serve queries in a forked worker process and report its counters.
+
+        The parent stops workers with SIGTERM; Ctrl-C in the terminal reaches
+        the whole process group, so workers ignore SIGINT and wait for the
+        parent. Each worker sends a final report before it exits, and stops by
+        itself if the parent is gone.
+        """
+        parent_pid = os.getppid()
+
+        def stop(signum, frame):
+            raise KeyboardInterrupt
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        def report(final: bool = False):
+            stats_queue.put((worker_id, self.counters(), final))
+            if not final and os.getppid() != parent_pid:
+                logger.error(f"Worker {worker_id}: parent process exited, stopping")
+                raise KeyboardInterrupt
+
+        server = None
+        try:
+            logger.info(f"Worker {worker_id} (pid {os.getpid()}) serving on {self.host}:{self.port}")
+            # One log file per worker, so workers never rotate each other's files
+            self.request_log = BlockedRequestLog(worker_log_path(self.request_log.path, worker_id))
+            self.install_reload_triggers()
+            if self.use_asyncio:
+                asyncio.run(self.serve_async(reuse_port=True, report=report))
+            else:
+                if self.upstream:
+                    self.upstream.open()
+                server = self.create_socket(reuse_port=True)
+                self.serve(server, report)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # A second SIGTERM must not interrupt the final report
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            report(final=True)
+            self.request_log.close()
+            if server:
+                server.close()
+            stats_queue.close()
+            stats_queue.join_thread()  # Make sure the final report is flushed to the parent
+
+    def start_workers(self, workers: int, shutdown_timeout: float = 5.0):
+        """Start the DNS server as several processes sharing one port.
+
+        The blocklist is loaded once before forking, so the workers share its
+        pages copy-on-write. Each worker reports its counters to the parent,
+        which logs the totals once every worker has reported. On SIGTERM or
+        SIGINT the parent asks the workers to stop, waits up to
+        `shutdown_timeout` seconds for their final reports and only then
+        kills the ones still running.
+        """
+        ctx = multiprocessing.get_context('fork')
+        stats_queue = ctx.Queue()
+        processes = [ctx.Process(target=self.run_worker, args=(i, stats_queue), daemon=True)
+                     for i in range(workers)]
+        for process in processes:
+            process.start()
+        logger.info(f"DNS server started on {self.host}:{self.port} with {workers} workers")
+        if hasattr(signal, 'SIGHUP'):
+            # Each worker holds its own copy of the blocklist, so each one reloads it
+            def forward_reload(signum, frame):
+                for process in processes:
+                    if process.is_alive():
+                        os.kill(process.pid, signal.SIGHUP)
+            signal.signal(signal.SIGHUP, forward_reload)
+
+        stopping = threading.Event()
+
+        def request_stop(signum, frame):
+            stopping.set()
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        worker_stats = {}
+        fresh = set()  # Workers that reported since the totals were last logged
+        finished = set()  # Workers that sent their final report
+
+        def log_totals():
+            totals = Counter()
+            for stats in worker_stats.values():
+                totals.update(stats)
+            logger.info(f"Totals across {len(worker_stats)} workers: {format_counters(totals)}")
+
+        def drain(timeout: float):
+            """Wait up to `timeout` for a report, then take every report already queued."""
+            try:
+                message = stats_queue.get(timeout=timeout)
+                while True:
+                    worker_id, stats, final = message
+                    worker_stats[worker_id] = stats
+                    fresh.add(worker_id)
+                    if final:
+                        finished.add(worker_id)
+                    message = stats_queue.get_nowait()
+            except queue.Empty:
+                pass
+
+        try:
+            while not stopping.is_set() and any(process.is_alive() for process in processes):
+                drain(0.5)
+                alive = {i for i, process in enumerate(processes) if process.is_alive()}
+                if alive and alive <= fresh:
+                    # A complete round of reports, so the totals are current
+                    log_totals()
+                    fresh.clear()
+            if not stopping.is_set():
+                logger.error("All workers exited")
+        finally:
+            logger.info("Shutting down workers")
+            for process in processes:
+                if process.is_alive():
+                    os.kill(process.pid, signal.SIGTERM)
+            deadline = time.monotonic() + shutdown_timeout
+            while len(finished) < workers and time.monotonic() < deadline:
+                if not any(process.is_alive() for process in processes):
+                    drain(0.1)  # Exited workers flushed their reports; take what is left
+                    break
+                drain(0.1)
+            for process in processes:
+                process.join(max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    logger.warning(f"Worker pid {process.pid} did not stop, killing it")
+                    process.terminate()
+                    process.join()
+            drain(0.0)
+            log_totals()
+
+
+class DNSServerProtocol(asyncio.DatagramProtocol):
+    """asyncio datagram front-end that answers queries with a DNSServer."""
+
+    def __init__(self, server: DNSServer):
+        self.server = server
+        self.transport = None
+        self.pending = set()
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]):
+        if self.server.upstream is None:
+            response = self.server.handle_query(data, addr)
+            if response:
+                self.transport.sendto(response, addr)
+            return
+        # Forwarded queries stay in flight while the loop keeps serving other clients
+        task = asyncio.ensure_future(self.respond(data, addr))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def respond(self, data: bytes, addr: Tuple[str, int]):
+        response = await self.server.handle_query_async(data, addr)
+        if response and not self.transport.is_closing():
+            self.transport.sendto(response, addr)
+
+    def error_received(self, exc: Exception):
+        logger.error(f"Error processing request: {str(exc)}")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DNS ad-blocking server')
+    parser.add_argument('--host', default='0.0.0.0', help='address to listen on')
+    parser.add_argument('--port', type=int, default=53, help='UDP port to listen on')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes sharing the port (SO_REUSEPORT)')
+    parser.add_argument('--async', dest='use_asyncio', action='store_true',
+                        help='serve queries from an asyncio event loop')
+    parser.add_argument('--batch', type=int, default=1, metavar='N',
+                        help='receive and answer up to N datagrams per wakeup (non-blocking loop)')
+    parser.add_argument('--upstream', action='append', default=[], metavar='HOST[:PORT]',
+                        help='resolver to forward non-blocked queries to (repeat for failover)')
+    parser.add_argument('--upstream-timeout', type=float, default=1.0,
+                        help='seconds to wait for each upstream before failing over')
+    parser.add_argument('--cache-size', type=int, default=10000,
+                        help='maximum number of cached upstream answers (0 disables the cache)')
+    parser.add_argument('--watch', type=float, default=0.0, metavar='SECONDS',
+                        help='reload the blocklist when its files change, checking every SECONDS')
+    parser.add_argument('--prefilter', action='store_true',
+                        help='check a Bloom filter of the blocklist before the exact lookup')
+    args = parser.parse_args()
     try:
-        server = DNSServer()
-        server.start()
+        server = DNSServer(args.host, args.port,
+                           [parse_upstream(spec) for spec in args.upstream],
+                           args.upstream_timeout, args.cache_size, args.prefilter)
+        server.use_asyncio = args.use_asyncio
+        server.batch_size = args.batch
+        server.watch_interval = args.watch
+        if args.workers > 1:
+            server.start_workers(args.workers)
+        elif args.use_asyncio:
+            server.start_async()
+        else:
+            server.start()
     except Exception as e:
         logger.error(f"Fatal error: {str(e)}")
         logger.error(traceback.format_exc())
-        raise 
\ No newline at end of file
+        raise 
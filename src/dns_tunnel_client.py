@@ -7,24 +7,101 @@ import os
 from pathlib import Path
 import json
 
+from dns_wire import (CLASSIC_UDP_SIZE, FLAG_TC, OPT_RECORD_SIZE, TYPE_TXT, character_string_capacity,
+                      edns_udp_size, iter_records, opt_record, parse_header, read_character_strings,
+                      skip_questions)
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+DEFAULT_CHUNK_SIZE = 100  # The server's chunk size for queries that do not choose one
+
+class RTTEstimator:
+    """Retransmission timeout from measured round-trip times, as TCP computes it (RFC 6298).
+
+    SRTT and RTTVAR are smoothed averages of the RTT and its variation, and
+    the timeout is SRTT + 4 * RTTVAR within [min_rto, max_rto]. As in Linux,
+    the variation term is at least `min_margin`: on a steady path RTTVAR
+    decays towards zero, and a timeout barely above SRTT fires on ordinary
+    jitter. Until the first sample the timeout is `initial_rto`. Each
+    retransmission of the same query doubles its timeout. Every query is
+    sent with its own transaction ID, so replies to retransmissions are
+    unambiguous and can be sampled too, which Karn's rule forbids in TCP.
+
+    RFC 6298 asks for at least 1 s. That floor guards TCP against delayed
+    ACKs, which hold a reply back by up to 500 ms, and against the cost of
+    a spurious timeout, which collapses the congestion window. A DNS server
+    answers each query at once, and a spurious retransmission only costs
+    one duplicate query, so 200 ms is enough here.
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+
+    def __init__(self, initial_rto=1.0, min_rto=0.2, max_rto=10.0, min_margin=0.1):
+        self.min_rto = min_rto
+        self.min_margin = min_margin
+        self.max_rto = max_rto
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.samples = 0
+        self.min_rtt = None
+        self.max_rtt = None
+        self.timeouts = 0
+
+    def sample(self, rtt):
+        """Fold one measured round-trip time into the estimate."""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        margin = max(4 * self.rttvar, self.min_margin)
+        self.rto = min(max(self.srtt + margin, self.min_rto), self.max_rto)
+        self.samples += 1
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+        self.max_rtt = rtt if self.max_rtt is None else max(self.max_rtt, rtt)
+
+    def timeout(self, attempt=0):
+        """Return how long to wait for a reply to the given (0-based) attempt."""
+        return min(self.rto * 2 ** attempt, self.max_rto)
+
+    def stats(self):
+        """Return the estimate and counters, times in milliseconds."""
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+        return {
+            'samples': self.samples,
+            'timeouts': self.timeouts,
+            'srtt_ms': ms(self.srtt),
+            'rttvar_ms': ms(self.rttvar),
+            'rto_ms': ms(self.rto),
+            'min_rtt_ms': ms(self.min_rtt),
+            'max_rtt_ms': ms(self.max_rtt),
+        }
+
 class DNSTunnelClient:
-    def __init__(self, server_ip, server_port=53, timeout=2, max_retries=3):
+    def __init__(self, server_ip, server_port=53, timeout=2, max_retries=3, edns_size=1232):
         self.server_ip = server_ip
         self.server_port = server_port
-        self.timeout = timeout
+        self.timeout = timeout  # Retransmission timeout until an RTT has been measured
         self.max_retries = max_retries
+        self.rtt = RTTEstimator(initial_rto=timeout)
+        self.next_id = 1
+        # UDP payload size advertised with EDNS0; 0 sends classic queries with 100-byte chunks
+        self.edns_size = edns_size
+        self.server_udp_size = None  # Largest response the server sends, from the OPT record of its replies
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.settimeout(self.timeout)
         self.transfer_state = {}
         self.base_dir = Path("downloads")
         self.base_dir.mkdir(exist_ok=True)
 
-    def create_dns_query(self, query_name, seq_num=None):
+    def create_dns_query(self, query_name, seq_num=None, query_id=0x0001):
         try:
-            # DNS header (12 bytes)
-            header = struct.pack('!HHHHHH', 0x0001, 1, 0, 0, 0, 0)
+            # DNS header (12 bytes): ID, flags (recursion desired), one question, OPT record if EDNS0
+            header = struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 1 if self.edns_size else 0)
             
             # Add sequence number if present
             if seq_num is not None:
@@ -37,48 +114,48 @@ class DNSTunnelClient:
                 query += struct.pack('!B', len(part)) + part.encode('utf-8')
             query += b'\x00'
             query += struct.pack('!HH', 16, 1)  # Type TXT, Class IN
+            if self.edns_size:
+                query += opt_record(self.edns_size)
             return header + query
         except Exception as e:
             logging.error(f"Error creating DNS query: {e}")
             return None
 
-    def parse_dns_response(self, data):
+    def parse_dns_response(self, data, expect_seq=False):
+        """Parse a TXT response into (data, seq_num, is_ack).
+
+        The server only prefixes the payload with an ACK flag and sequence
+        number when the query carried one, so the prefix is only read when
+        `expect_seq` is set.
+        """
         try:
-            # Skip the DNS header (12 bytes)
-            offset = 12
-            # Skip the query section
-            while data[offset] != 0:
-                offset += data[offset] + 1
-            offset += 1  # null terminator
-            offset += 4  # type (2) + class (2)
-            
-            # Now at the answer section
-            offset += 2  # name pointer
-            offset += 2  # type
-            offset += 2  # class
-            offset += 4  # TTL
-            rdlength = struct.unpack('!H', data[offset:offset+2])[0]
-            offset += 2
-            
-            # Check if this is an ACK response
-            if rdlength >= 5:  # ACK flag (1) + seq_num (4)
-                is_ack = bool(data[offset])
-                seq_num = struct.unpack('!I', data[offset+1:offset+5])[0]
-                offset += 5
-                if is_ack:
-                    return None, seq_num, True
-            
-            # TXT record: 1 byte length, then the data
-            txt_length = data[offset]
-            offset += 1
-            txt_data = data[offset:offset + txt_length]
+            header = parse_header(data)
+            offset = skip_questions(data, header.qdcount)
+            # Servers without EDNS0 send no OPT record and at most 512 bytes
+            self.server_udp_size = edns_udp_size(data, header, offset) or CLASSIC_UDP_SIZE
+            if header.flags & FLAG_TC:
+                logging.warning(f"DNS response was truncated; the chunk does not fit "
+                                f"{min(self.edns_size, self.server_udp_size)} bytes")
+                return None, None, False
+            for record in iter_records(data, offset, header.ancount):
+                if record.rtype == TYPE_TXT:
+                    break
+            else:
+                logging.error("DNS response has no TXT answer")
+                return None, None, False
+
+            # TXT record: one or more character-strings (1 byte length, then data)
+            txt_data = read_character_strings(data, record.rdata_offset, record.rdlength)
+            txt_length = len(txt_data)
             
             # Extract sequence number if present
             seq_num = None
-            if txt_length >= 5:  # ACK flag (1) + seq_num (4)
+            if expect_seq and txt_length >= 5:  # ACK flag (1) + seq_num (4)
                 is_ack = bool(txt_data[0])
                 seq_num = struct.unpack('!I', txt_data[1:5])[0]
                 txt_data = txt_data[5:]
+                if is_ack:
+                    return None, seq_num, True
             
             logging.info(f"Received TXT data length: {len(txt_data)}")
             return txt_data, seq_num, False
@@ -86,31 +163,96 @@ class DNSTunnelClient:
             logging.error(f"Error parsing DNS response: {e}")
             return None, None, False
 
-    def request_file_chunk(self, chunk_num, filename, domain, seq_num=None):
-        query_name = f"chunk-{chunk_num}-{filename}.{domain}"
-        query = self.create_dns_query(query_name, seq_num)
-        if not query:
-            return None, None
+    def session_chunk_size(self, filename, domain):
+        """Return the largest chunk whose response fits the EDNS0 payload size, or None without EDNS0.
+
+        Once a reply has told us the server's own limit, the smaller of the two is used.
+        """
+        if not self.edns_size:
+            return None
+        udp_size = min(self.edns_size, self.server_udp_size or self.edns_size)
+        # Header, echoed question with the longest chunk number, answer RR and OPT record
+        longest_name = f"chunk-{'9' * 10}-{'9' * 5}-{filename}.{domain}"
+        overhead = 12 + len(longest_name) + 2 + 4 + 12 + OPT_RECORD_SIZE
+        # Leave room for the ACK flag and sequence number
+        return max(character_string_capacity(udp_size - overhead) - 5, 1)
+
+    def negotiate_chunk_size(self, filename, domain):
+        """Return the chunk size for a new download, capped by the server's advertised payload size.
+
+        Until the server has replied once, chunk 1 is requested at our own
+        size. Its reply, even a truncated one, carries the server's OPT
+        record, and the chunk size is recomputed from the smaller limit.
+        """
+        chunk_size = self.session_chunk_size(filename, domain)
+        if chunk_size is None or self.server_udp_size is not None:
+            return chunk_size
+        self.request_file_chunk(1, filename, domain, chunk_size=chunk_size)
+        negotiated = self.session_chunk_size(filename, domain)
+        if negotiated != chunk_size:
+            logging.info(f"Server accepts {self.server_udp_size}-byte responses; "
+                         f"using {negotiated}-byte chunks instead of {chunk_size}")
+        return negotiated
+
+    def next_query_id(self):
+        """Return a fresh transaction ID, so every reply can be matched to the query it answers."""
+        query_id = self.next_id
+        self.next_id = self.next_id % 0xFFFF + 1
+        return query_id
+
+    def receive_reply(self, sent, deadline):
+        """Wait until `deadline` for a reply to one of the `sent` {query ID: send time} queries.
+
+        Replies to other queries, e.g. late answers to an earlier chunk, are
+        discarded. The reply's round-trip time is added to the RTT estimate.
+        """
+        while True:
+            self.sock.settimeout(max(deadline - time.monotonic(), 0.001))
+            try:
+                data, _ = self.sock.recvfrom(max(self.edns_size, CLASSIC_UDP_SIZE))
+            finally:
+                self.sock.settimeout(self.timeout)
+            if len(data) >= 2:
+                sent_at = sent.get(struct.unpack('!H', data[:2])[0])
+                if sent_at is not None:
+                    self.rtt.sample(time.monotonic() - sent_at)
+                    return data
+            if time.monotonic() >= deadline:
+                raise socket.timeout()
+
+    def request_file_chunk(self, chunk_num, filename, domain, seq_num=None, chunk_size=None):
+        if chunk_size:
+            query_name = f"chunk-{chunk_num}-{chunk_size}-{filename}.{domain}"
+        else:
+            query_name = f"chunk-{chunk_num}-{filename}.{domain}"
         
+        # Retransmit as soon as the adaptive timeout expires; replies to any attempt count
+        sent = {}
         for retry in range(self.max_retries):
             try:
+                query_id = self.next_query_id()
+                query = self.create_dns_query(query_name, seq_num, query_id)
+                if not query:
+                    return None, None
+                sent[query_id] = time.monotonic()
                 self.sock.sendto(query, (self.server_ip, self.server_port))
-                data, _ = self.sock.recvfrom(512)
+                data = self.receive_reply(sent, sent[query_id] + self.rtt.timeout(retry))
                 logging.debug(f"Received DNS response hex: {data.hex()}")
-                chunk_data, resp_seq_num, is_ack = self.parse_dns_response(data)
+                chunk_data, resp_seq_num, is_ack = self.parse_dns_response(data, seq_num is not None)
                 
                 if is_ack:
                     # Send ACK acknowledgment
                     ack_query = self.create_dns_query(f"ack-{resp_seq_num}.{domain}")
-                    self.sock.sendto(ack_query, (self.server_ip, self.server_port))
+                    if ack_query:
+                        self.sock.sendto(ack_query, (self.server_ip, self.server_port))
                     return None, resp_seq_num
                 
                 return chunk_data, resp_seq_num
             except socket.timeout:
+                self.rtt.timeouts += 1
                 logging.warning(f"Timeout requesting chunk {chunk_num} (attempt {retry + 1}/{self.max_retries})")
                 if retry == self.max_retries - 1:
                     return None, None
-                time.sleep(1)  # Wait before retrying
             except Exception as e:
                 logging.error(f"Error requesting chunk {chunk_num}: {e}")
                 return None, None
@@ -128,50 +270,192 @@ class DNSTunnelClient:
             return True
         return False
 
-    def download_file(self, filename, domain, num_chunks=None, resume=True):
+    def start_transfer(self, filename, domain, num_chunks, resume):
+        """Load the saved state of a download, or start a new one; returns True when resuming.
+
+        Both download modes keep the same state: `last_chunk` is the chunk
+        up to which every chunk is written, and the file holds exactly those
+        chunks, so a download started in one mode can be resumed in the other.
+        """
         if resume and self.load_transfer_state(filename):
-            logging.info(f"Resuming download of {filename} from chunk {self.transfer_state.get('last_chunk', 1)}")
-            start_chunk = self.transfer_state.get('last_chunk', 1)
-        else:
-            start_chunk = 1
-            self.transfer_state = {'last_chunk': 0, 'total_chunks': num_chunks}
-        
-        output_file = self.base_dir / filename
-        mode = 'ab' if start_chunk > 1 else 'wb'
-        
-        with open(output_file, mode) as f:
-            chunk_num = start_chunk
+            logging.info(f"Resuming download of {filename} after chunk {self.transfer_state.get('last_chunk', 0)}")
+            return True
+        self.transfer_state = {'last_chunk': 0, 'total_chunks': num_chunks,
+                               'chunk_size': self.negotiate_chunk_size(filename, domain)}
+        return False
+
+    def open_output(self, filename, resuming, chunk_size):
+        """Open the download file, dropping anything written past the saved state."""
+        flags = os.O_WRONLY | os.O_CREAT | (0 if resuming else os.O_TRUNC)
+        fd = os.open(self.base_dir / filename, flags, 0o644)
+        written = self.transfer_state.get('last_chunk', 0) * (chunk_size or DEFAULT_CHUNK_SIZE)
+        if os.fstat(fd).st_size > written:
+            os.ftruncate(fd, written)
+        return fd
+
+    def finish_transfer(self, filename):
+        """Remove the saved state of a finished download and log the RTT statistics."""
+        if os.path.exists(self.base_dir / f"{filename}.state"):
+            os.remove(self.base_dir / f"{filename}.state")
+        logging.info(f"RTT statistics: {self.rtt.stats()}")
+
+    def download_file(self, filename, domain, num_chunks=None, resume=True, window=1):
+        """Download a file chunk by chunk; a window above 1 keeps that many queries in flight.
+
+        Without `num_chunks`, a chunk shorter than the chunk size, or the
+        server's empty answer past the end of the file, ends the download.
+        """
+        if window > 1:
+            return self.download_file_windowed(filename, domain, num_chunks, resume, window)
+        resuming = self.start_transfer(filename, domain, num_chunks, resume)
+        # A resumed download keeps the chunk size it started with, so chunk offsets stay the same
+        chunk_size = self.transfer_state.get('chunk_size')
+        offset_size = chunk_size or DEFAULT_CHUNK_SIZE
+
+        fd = self.open_output(filename, resuming, chunk_size)
+        try:
+            chunk_num = self.transfer_state.get('last_chunk', 0) + 1
             while num_chunks is None or chunk_num <= num_chunks:
-                chunk_data, seq_num = self.request_file_chunk(chunk_num, filename, domain)
+                chunk_data, seq_num = self.request_file_chunk(chunk_num, filename, domain,
+                                                              chunk_size=chunk_size)
                 
                 if chunk_data is None:
                     if seq_num is not None:
                         # This was an ACK response, continue with next chunk
-                        chunk_num += 1
                         self.transfer_state['last_chunk'] = chunk_num
                         self.save_transfer_state(filename)
+                        chunk_num += 1
                         continue
                     else:
                         logging.error(f"Failed to receive chunk {chunk_num}")
                         return False
                 
-                f.write(chunk_data)
+                os.pwrite(fd, chunk_data, (chunk_num - 1) * offset_size)
                 logging.info(f"Received chunk {chunk_num}/{num_chunks if num_chunks else '?'}")
                 
                 # Update transfer state
                 self.transfer_state['last_chunk'] = chunk_num
                 self.save_transfer_state(filename)
                 
-                # If we received an empty chunk, we're done
-                if len(chunk_data) == 0:
+                # A short or empty chunk is the last one
+                if len(chunk_data) < offset_size:
                     break
                 
                 chunk_num += 1
+        finally:
+            os.close(fd)
         
-        # Clean up state file after successful download
-        if os.path.exists(self.base_dir / f"{filename}.state"):
-            os.remove(self.base_dir / f"{filename}.state")
-        
+        self.finish_transfer(filename)
+        return True
+
+    def download_file_windowed(self, filename, domain, num_chunks=None, resume=True, window=16):
+        """Download a file with up to `window` chunk queries in flight.
+
+        Replies are matched to chunks by DNS transaction ID and written at
+        their offset as they arrive, in any order. Only chunks whose reply is
+        overdue are sent again. Without `num_chunks`, the first chunk shorter
+        than the chunk size marks the end of the file. When the size is an
+        exact multiple of the chunk size, that is the server's empty answer
+        for the chunk past the end.
+        """
+        resuming = self.start_transfer(filename, domain, num_chunks, resume)
+        chunk_size = self.transfer_state.get('chunk_size')
+        offset_size = chunk_size or DEFAULT_CHUNK_SIZE
+        last_chunk = num_chunks
+        done = self.transfer_state.get('last_chunk', 0)  # Every chunk up to here was written
+        received = set()
+        next_chunk = done + 1
+        pending = {}  # chunk number -> (deadline, attempts, send time)
+        query_ids = {}  # transaction ID -> (chunk number, send time)
+        last_save = time.monotonic()
+        buffer_size = max(self.edns_size, CLASSIC_UDP_SIZE)
+        server = (self.server_ip, self.server_port)
+
+        fd = self.open_output(filename, resuming, chunk_size)
+        try:
+            while True:
+                # Fill the window with new chunks
+                while len(pending) < window and (last_chunk is None or next_chunk <= last_chunk):
+                    pending[next_chunk] = (0, 0, None)
+                    next_chunk += 1
+                if not pending:
+                    break
+
+                # (Re)send every chunk whose reply is overdue
+                now = time.monotonic()
+                for chunk_num, (deadline, attempts, _) in list(pending.items()):
+                    if deadline > now:
+                        continue
+                    if attempts == self.max_retries:
+                        logging.error(f"Failed to receive chunk {chunk_num}")
+                        return False
+                    if attempts:
+                        self.rtt.timeouts += 1
+                        logging.warning(f"Timeout requesting chunk {chunk_num} "
+                                        f"(attempt {attempts}/{self.max_retries})")
+                    if chunk_size:
+                        query_name = f"chunk-{chunk_num}-{chunk_size}-{filename}.{domain}"
+                    else:
+                        query_name = f"chunk-{chunk_num}-{filename}.{domain}"
+                    query_id = self.next_query_id()
+                    query = self.create_dns_query(query_name, query_id=query_id)
+                    if not query:
+                        return False
+                    query_ids[query_id] = (chunk_num, time.monotonic())
+                    self.sock.sendto(query, server)
+                    pending[chunk_num] = (now + self.rtt.timeout(attempts), attempts + 1, now)
+
+                # Wait for a reply until the earliest deadline
+                wait = min(deadline for deadline, _, _ in pending.values()) - time.monotonic()
+                self.sock.settimeout(max(wait, 0.001))
+                try:
+                    data, _ = self.sock.recvfrom(buffer_size)
+                except socket.timeout:
+                    continue
+                finally:
+                    self.sock.settimeout(self.timeout)
+                if len(data) < 2:
+                    continue
+                chunk_num, sent_at = query_ids.pop(struct.unpack('!H', data[:2])[0], (None, None))
+                if chunk_num is None:
+                    continue  # Not a reply to one of our queries
+                self.rtt.sample(time.monotonic() - sent_at)
+                if self.rtt.samples == 1:
+                    # Queries sent before the first sample waited for the initial timeout
+                    for n, (deadline, attempts, last_sent) in pending.items():
+                        if last_sent is not None:
+                            deadline = min(deadline, last_sent + self.rtt.timeout(attempts - 1))
+                            pending[n] = (deadline, attempts, last_sent)
+                if chunk_num not in pending:
+                    continue  # Late reply to a query that was already answered
+                chunk_data, _, _ = self.parse_dns_response(data)
+                if chunk_data is None:
+                    continue
+                os.pwrite(fd, chunk_data, (chunk_num - 1) * offset_size)
+                del pending[chunk_num]
+                received.add(chunk_num)
+                logging.info(f"Received chunk {chunk_num}/{last_chunk if last_chunk else '?'}")
+                if len(chunk_data) < offset_size and last_chunk is None:
+                    # A short or empty chunk is the last one; stop asking for anything after it
+                    last_chunk = chunk_num
+                    for later in [n for n in pending if n > last_chunk]:
+                        del pending[later]
+
+                while done + 1 in received:
+                    done += 1
+                    received.discard(done)
+                self.transfer_state['last_chunk'] = done
+                if time.monotonic() - last_save >= 1.0:
+                    self.save_transfer_state(filename)
+                    last_save = time.monotonic()
+        finally:
+            # Drop chunks written past the resume point, so the file matches the saved state
+            if pending:
+                os.ftruncate(fd, min(os.fstat(fd).st_size, done * offset_size))
+                self.save_transfer_state(filename)
+            os.close(fd)
+
+        self.finish_transfer(filename)
         return True
 
     def compute_md5(self, filename):
@@ -1,3 +1,4 @@
+import argparse
 import socket
 import struct
 import logging
@@ -5,6 +6,11 @@ import os
 import json
 from pathlib import Path
 
+from batch_io import serve_batched
+from dns_wire import (CLASSIC_UDP_SIZE, DNSParseError, edns_udp_size, encode_character_strings,
+                      opt_record, parse_header, parse_query, skip_questions)
+from file_cache import MappedFileCache
+
 logging.basicConfig(
     level=logging.DEBUG,
     format='%(asctime)s - %(levelname)s - %(message)s',
@@ -14,31 +20,29 @@ logging.basicConfig(
     ]
 )
 
+# Returned by handle_file_request for a chunk too large for any response
+TRUNCATED = object()
+
 class DNSTunnelServer:
-    def __init__(self, host='0.0.0.0', port=53):
+    def __init__(self, host='0.0.0.0', port=53, max_open_files=64):
         self.host = host
         self.port = port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.bind((self.host, self.port))
-        self.chunk_size = 100  # Maximum size of each chunk in bytes
+        self.chunk_size = 100  # Chunk size in bytes when the query does not choose one
+        self.max_udp_size = 4096  # UDP payload size advertised in EDNS0 replies
         self.transfer_state = {}  # Track transfer state for each client
         self.base_dir = Path("files")  # Directory to store files
         self.base_dir.mkdir(exist_ok=True)
+        # Served files stay mapped, so a chunk is copied from the mapping instead of a new open/seek/read
+        self.file_cache = MappedFileCache(max_open_files) if max_open_files else None
         logging.info(f"DNS Tunnel Server listening on {self.host}:{self.port}")
 
     def parse_dns_query(self, data):
         try:
-            # Extract the query name from the DNS packet
-            offset = 12
-            name = []
-            while True:
-                length = data[offset]
-                if length == 0:
-                    break
-                offset += 1
-                name.append(data[offset:offset + length].decode('utf-8'))
-                offset += length
-            query_name = '.'.join(name)
+            # Extract the query name from the DNS packet (file names are case-sensitive)
+            _, question = parse_query(data, lowercase=False)
+            query_name = question.qname.decode('utf-8')
             
             # Extract sequence number if present
             seq_num = None
@@ -54,55 +58,99 @@ class DNSTunnelServer:
             logging.error(f"Error parsing DNS query: {e}")
             return None, None
 
-    def create_dns_response(self, query_name, data, seq_num=None, is_ack=False):
+    def parse_edns_size(self, data):
+        """Return the UDP payload size the client advertised with EDNS0, or None."""
+        try:
+            header = parse_header(data)
+            return edns_udp_size(data, header, skip_questions(data, header.qdcount))
+        except DNSParseError as e:
+            logging.error(f"Error parsing EDNS0 record: {e}")
+            return None
+
+    def encode_question(self, query_name):
+        """Encode the question section echoed in every response."""
+        query = b''
+        for part in query_name.split('.'):
+            query += struct.pack('!B', len(part)) + part.encode('utf-8')
+        query += b'\x00'
+        query += struct.pack('!HH', 16, 1)  # Type TXT, Class IN
+        return query
+
+    def create_truncated_response(self, query_name, query_id=0, udp_size=None):
+        """Answer with TC set and no data.
+
+        Clients that sent an OPT record still get ours, so they learn the
+        largest response this server sends and can ask for smaller chunks.
+        """
+        additional = opt_record(self.max_udp_size) if udp_size else b''
+        header = struct.pack('!HHHHHH', query_id, 0x8380, 1, 0, 0, 1 if udp_size else 0)
+        return header + self.encode_question(query_name) + additional
+
+    def create_dns_response(self, query_name, data, seq_num=None, is_ack=False, query_id=0, udp_size=None):
         try:
-            # DNS header (12 bytes)
-            header = struct.pack('!HHHHHH', 0x8180, 1, 1, 0, 0, 0)
+            # Clients that sent an OPT record get one back in the additional section
+            additional = opt_record(self.max_udp_size) if udp_size else b''
+            arcount = 1 if udp_size else 0
             
-            # Query section
-            query_parts = query_name.split('.')
-            query = b''
-            for part in query_parts:
-                query += struct.pack('!B', len(part)) + part.encode('utf-8')
-            query += b'\x00'
-            query += struct.pack('!HH', 16, 1)  # Type TXT, Class IN
+            # DNS header (12 bytes): ID, flags, one question, one answer
+            header = struct.pack('!HHHHHH', query_id, 0x8180, 1, 1, 0, arcount)
             
-            # Answer section
-            answer = struct.pack('!H', 0xC000 | 12)  # Name pointer
-            answer += struct.pack('!HHIH', 16, 1, 300, len(data) + 1)
+            query = self.encode_question(query_name)
             
             # Add sequence number and ACK flag if present
             if seq_num is not None:
                 data = struct.pack('!B', 1 if is_ack else 0) + struct.pack('!I', seq_num) + data
             
-            answer += struct.pack('!B', len(data)) + data
-            response = header + query + answer
+            # Answer section: the data split into 255-byte character-strings
+            txt = encode_character_strings(data)
+            answer = struct.pack('!H', 0xC000 | 12)  # Name pointer
+            answer += struct.pack('!HHIH', 16, 1, 300, len(txt))
+            answer += txt
+            response = header + query + answer + additional
+            
+            limit = min(udp_size or CLASSIC_UDP_SIZE, self.max_udp_size)
+            if len(response) > limit:
+                # Too big for the client's buffer or ours: answer with TC set and no data
+                logging.warning(f"Response of {len(response)} bytes exceeds {limit}, sending it truncated")
+                return self.create_truncated_response(query_name, query_id, udp_size)
             logging.info(f"Created DNS response with TXT data length: {len(data)}")
             return response
         except Exception as e:
             logging.error(f"Error creating DNS response: {e}")
             return None
 
-    def get_file_chunk(self, filename, chunk_num, client_id):
+    def get_file_chunk(self, filename, chunk_num, client_id, chunk_size=None):
         try:
+            chunk_size = chunk_size or self.chunk_size
             file_path = self.base_dir / filename
-            if not file_path.exists():
-                logging.error(f"File not found: {filename}")
-                return None
-                
-            with open(file_path, 'rb') as f:
-                f.seek((chunk_num - 1) * self.chunk_size)
-                chunk = f.read(self.chunk_size)
-                
+            if self.file_cache is not None:
+                result = self.file_cache.read(str(file_path), (chunk_num - 1) * chunk_size, chunk_size)
+                if result is None:
+                    logging.error(f"File not found: {filename}")
+                    return None
+                chunk, file_size = result
+            else:
+                if not file_path.exists():
+                    logging.error(f"File not found: {filename}")
+                    return None
+                with open(file_path, 'rb') as f:
+                    f.seek((chunk_num - 1) * chunk_size)
+                    chunk = f.read(chunk_size)
+                file_size = None
+
             if not chunk:
-                return None
+                return b''  # Past the end of the file; the empty answer tells the client it is done
                 
-            # Update transfer state
-            if client_id not in self.transfer_state:
+            # Update transfer state; a new file or chunk size starts a new session
+            session = self.transfer_state.get(client_id)
+            if session is None or session['filename'] != filename or session['chunk_size'] != chunk_size:
+                if file_size is None:
+                    file_size = os.path.getsize(file_path)
                 self.transfer_state[client_id] = {
                     'filename': filename,
+                    'chunk_size': chunk_size,
                     'last_chunk': chunk_num,
-                    'total_chunks': (os.path.getsize(file_path) + self.chunk_size - 1) // self.chunk_size
+                    'total_chunks': (file_size + chunk_size - 1) // chunk_size
                 }
             else:
                 self.transfer_state[client_id]['last_chunk'] = chunk_num
@@ -126,18 +174,27 @@ class DNSTunnelServer:
                     return b'ACK', True
                 return None, None
                 
-            # Handle normal file requests
+            # Handle normal file requests: chunk-N-filename, or chunk-N-SIZE-filename
+            # for clients that choose their chunk size
             chunk_info = parts[0].split('-')
-            if len(chunk_info) != 3 or chunk_info[0] != 'chunk':
+            if len(chunk_info) not in (3, 4) or chunk_info[0] != 'chunk':
                 logging.error(f"Invalid chunk format: {parts[0]}")
                 return None, None
                 
             chunk_num = int(chunk_info[1])
-            filename = chunk_info[2]
+            chunk_size = int(chunk_info[2]) if len(chunk_info) == 4 else None
+            if chunk_size is not None and chunk_size <= 0:
+                logging.error(f"Invalid chunk size: {chunk_size}")
+                return None, None
+            if chunk_size is not None and chunk_size > self.max_udp_size:
+                # Cannot fit one response; the TC reply tells the client our limit
+                logging.warning(f"Chunk size {chunk_size} exceeds {self.max_udp_size}, answering truncated")
+                return TRUNCATED, False
+            filename = chunk_info[-1]
             client_id = f"{client_addr[0]}:{client_addr[1]}"
             
-            chunk_data = self.get_file_chunk(filename, chunk_num, client_id)
-            if chunk_data:
+            chunk_data = self.get_file_chunk(filename, chunk_num, client_id, chunk_size)
+            if chunk_data is not None:
                 logging.info(f"Preparing TXT data for chunk {chunk_num} of {filename}")
                 return chunk_data, False
             return None, None
@@ -145,27 +202,48 @@ class DNSTunnelServer:
             logging.error(f"Error handling file request: {e}")
             return None, None
 
-    def start(self):
+    def handle_packet(self, data, addr):
+        """Answer one query packet; returns the response or None."""
+        query_name, seq_num = self.parse_dns_query(data)
+        
+        if query_name:
+            logging.info(f"Received query for: {query_name}")
+            response_data, is_ack = self.handle_file_request(query_name, seq_num, addr)
+            
+            if response_data is TRUNCATED:
+                query_id = struct.unpack('!H', data[0:2])[0]
+                return self.create_truncated_response(query_name, query_id, self.parse_edns_size(data))
+            if response_data is not None:
+                query_id = struct.unpack('!H', data[0:2])[0]
+                udp_size = self.parse_edns_size(data)
+                response = self.create_dns_response(query_name, response_data, seq_num, is_ack,
+                                                    query_id, udp_size)
+                if response:
+                    logging.debug(f"DNS response hex: {response.hex()}")
+                    logging.info(f"Sent response for: {query_name}")
+                    return response
+        return None
+
+    def start(self, batch_size=1):
+        """Serve queries forever; a batch_size above 1 uses the batched I/O loop."""
         logging.info("DNS Tunnel Server started and waiting for queries...")
+        if batch_size > 1:
+            serve_batched(self.sock, self.handle_packet, batch_size)
+            return
         while True:
             try:
                 data, addr = self.sock.recvfrom(512)
                 logging.info(f"Received UDP packet from {addr}")
-                query_name, seq_num = self.parse_dns_query(data)
-                
-                if query_name:
-                    logging.info(f"Received query for: {query_name}")
-                    response_data, is_ack = self.handle_file_request(query_name, seq_num, addr)
-                    
-                    if response_data:
-                        response = self.create_dns_response(query_name, response_data, seq_num, is_ack)
-                        if response:
-                            logging.debug(f"DNS response hex: {response.hex()}")
-                            self.sock.sendto(response, addr)
-                            logging.info(f"Sent response for: {query_name}")
+                response = self.handle_packet(data, addr)
+                if response:
+                    self.sock.sendto(response, addr)
             except Exception as e:
                 logging.error(f"Error in main loop: {e}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='DNS tunnel file server')
+    parser.add_argument('--batch', type=int, default=1, metavar='N',
+                        help='receive and answer up to N datagrams per wakeup (non-blocking loop)')
+    args = parser.parse_args()
     server = DNSTunnelServer()
-    server.start() 
\ No newline at end of file
+    server.start(batch_size=args.batch)
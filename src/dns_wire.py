@@ -0,0 +1,231 @@
+"""Bounds-checked DNS wire-format parsing shared by the DNS servers and client.
+
+The parser works on a memoryview of the packet, so labels are not copied
+until the final name is assembled. Every length and pointer is checked
+against the packet size, compression pointers may only jump backwards and
+only MAX_POINTER_JUMPS times, so a malformed packet is rejected after a
+bounded amount of work.
+"""
+import struct
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+HEADER_SIZE = 12
+MAX_NAME_LENGTH = 255
+MAX_POINTER_JUMPS = 16
+MAX_STRING_LENGTH = 255   # TXT character-strings have a one-byte length
+CLASSIC_UDP_SIZE = 512    # Largest UDP message without EDNS0
+OPT_RECORD_SIZE = 11
+
+TYPE_A = 1
+TYPE_SOA = 6
+TYPE_TXT = 16
+TYPE_AAAA = 28
+TYPE_OPT = 41
+CLASS_IN = 1
+
+FLAG_QR = 0x8000
+FLAG_TC = 0x0200
+
+_HEADER = struct.Struct('!HHHHHH')
+_RR_FIXED = struct.Struct('!HHIH')
+
+
+class DNSParseError(ValueError):
+    """Raised when a packet is truncated or malformed."""
+
+
+class Header(NamedTuple):
+    id: int
+    flags: int
+    qdcount: int
+    ancount: int
+    nscount: int
+    arcount: int
+
+
+class Question(NamedTuple):
+    qname: bytes      # Dotted name, lower-cased unless requested otherwise
+    qtype: int
+    qclass: int
+    name_end: int     # Offset just past the encoded name
+    end: int          # Offset just past QTYPE and QCLASS
+
+
+class Record(NamedTuple):
+    name_offset: int
+    rtype: int
+    rclass: int
+    ttl: int
+    ttl_offset: int
+    rdata_offset: int
+    rdlength: int
+
+
+def parse_header(data: bytes) -> Header:
+    """Parse the fixed 12-byte header."""
+    if len(data) < HEADER_SIZE:
+        raise DNSParseError(f"Packet too short for a DNS header: {len(data)} bytes")
+    return Header(*_HEADER.unpack_from(data, 0))
+
+
+def read_name(data: bytes, offset: int, lowercase: bool = True) -> Tuple[bytes, int]:
+    """Read a possibly compressed name.
+
+    Returns the dotted name and the offset just past the name at its original
+    position (after the first compression pointer, if any).
+    """
+    view = memoryview(data)
+    size = len(view)
+    labels = []
+    name_length = 0
+    end = None
+    jumps = 0
+    while True:
+        if offset >= size:
+            raise DNSParseError("Name runs past the end of the packet")
+        length = view[offset]
+        if length == 0:
+            offset += 1
+            break
+        kind = length & 0xC0
+        if kind == 0xC0:
+            if offset + 1 >= size:
+                raise DNSParseError("Truncated compression pointer")
+            pointer = ((length & 0x3F) << 8) | view[offset + 1]
+            if pointer >= offset:
+                raise DNSParseError("Compression pointer does not point backwards")
+            jumps += 1
+            if jumps > MAX_POINTER_JUMPS:
+                raise DNSParseError("Too many compression pointers")
+            if end is None:
+                end = offset + 2
+            offset = pointer
+            continue
+        if kind:
+            raise DNSParseError(f"Unsupported label type 0x{kind:02x}")
+        start = offset + 1
+        offset = start + length
+        if offset > size:
+            raise DNSParseError("Label runs past the end of the packet")
+        name_length += length + 1
+        if name_length > MAX_NAME_LENGTH:
+            raise DNSParseError("Name is longer than 255 bytes")
+        labels.append(view[start:offset])
+    name = b'.'.join(labels)
+    if lowercase:
+        name = name.lower()
+    return name, offset if end is None else end
+
+
+def skip_name(data: bytes, offset: int) -> int:
+    """Return the offset just past a name without assembling it."""
+    size = len(data)
+    length_total = 0
+    while True:
+        if offset >= size:
+            raise DNSParseError("Name runs past the end of the packet")
+        length = data[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0 == 0xC0:
+            if offset + 2 > size:
+                raise DNSParseError("Truncated compression pointer")
+            return offset + 2
+        if length & 0xC0:
+            raise DNSParseError(f"Unsupported label type 0x{length & 0xC0:02x}")
+        offset += length + 1
+        length_total += length + 1
+        if length_total > MAX_NAME_LENGTH:
+            raise DNSParseError("Name is longer than 255 bytes")
+
+
+def parse_question(data: bytes, offset: int = HEADER_SIZE, lowercase: bool = True) -> Question:
+    """Parse the question starting at `offset` (the first one by default)."""
+    qname, name_end = read_name(data, offset, lowercase)
+    end = name_end + 4
+    if end > len(data):
+        raise DNSParseError("Question runs past the end of the packet")
+    qtype, qclass = struct.unpack_from('!HH', data, name_end)
+    return Question(qname, qtype, qclass, name_end, end)
+
+
+def parse_query(data: bytes, lowercase: bool = True) -> Tuple[Header, Question]:
+    """Parse the header and first question of a query, rejecting responses."""
+    header = parse_header(data)
+    if header.flags & FLAG_QR:
+        raise DNSParseError("Packet is a response, not a query")
+    if header.qdcount < 1:
+        raise DNSParseError("Query has no question")
+    return header, parse_question(data, HEADER_SIZE, lowercase)
+
+
+def skip_questions(data: bytes, count: int, offset: int = HEADER_SIZE) -> int:
+    """Return the offset just past `count` questions."""
+    for _ in range(count):
+        offset = skip_name(data, offset) + 4
+    if offset > len(data):
+        raise DNSParseError("Question runs past the end of the packet")
+    return offset
+
+
+def iter_records(data: bytes, offset: int, count: int) -> Iterator[Record]:
+    """Yield `count` resource records starting at `offset`."""
+    size = len(data)
+    for _ in range(count):
+        name_offset = offset
+        offset = skip_name(data, offset)
+        if offset + _RR_FIXED.size > size:
+            raise DNSParseError("Record header runs past the end of the packet")
+        rtype, rclass, ttl, rdlength = _RR_FIXED.unpack_from(data, offset)
+        rdata_offset = offset + _RR_FIXED.size
+        if rdata_offset + rdlength > size:
+            raise DNSParseError("Record data runs past the end of the packet")
+        yield Record(name_offset, rtype, rclass, ttl, offset + 4, rdata_offset, rdlength)
+        offset = rdata_offset + rdlength
+
+
+
+def edns_udp_size(data: bytes, header: Header, offset: int) -> Optional[int]:
+    """Return the UDP payload size advertised by an EDNS0 OPT record, or None without one.
+
+    `offset` is the end of the question section. Sizes below 512 are
+    treated as 512, as RFC 6891 requires.
+    """
+    for record in iter_records(data, offset, header.ancount + header.nscount + header.arcount):
+        if record.rtype == TYPE_OPT:
+            return max(record.rclass, CLASSIC_UDP_SIZE)  # The OPT "class" is the payload size
+    return None
+
+
+def opt_record(udp_size: int) -> bytes:
+    """Encode an EDNS0 OPT record advertising `udp_size` bytes, with no options."""
+    return b'\x00' + _RR_FIXED.pack(TYPE_OPT, udp_size, 0, 0)
+
+
+def encode_character_strings(data: bytes) -> bytes:
+    """Encode data as consecutive length-prefixed character-strings of up to 255 bytes."""
+    if not data:
+        return b'\x00'
+    return b''.join(bytes([len(data[i:i + MAX_STRING_LENGTH])]) + data[i:i + MAX_STRING_LENGTH]
+                    for i in range(0, len(data), MAX_STRING_LENGTH))
+
+
+def read_character_strings(data: bytes, offset: int, length: int) -> bytes:
+    """Concatenate the character-strings in `length` bytes of RDATA starting at `offset`."""
+    end = offset + length
+    if end > len(data):
+        raise DNSParseError("Record data runs past the end of the packet")
+    parts = []
+    while offset < end:
+        string_end = offset + 1 + data[offset]
+        if string_end > end:
+            raise DNSParseError("Character-string runs past the end of the record")
+        parts.append(data[offset + 1:string_end])
+        offset = string_end
+    return b''.join(parts)
+
+
+def character_string_capacity(space: int) -> int:
+    """Return the most data that fits in `space` bytes of character-strings."""
+    # Every started 255-byte string costs one length byte
+    return max(space - (space + MAX_STRING_LENGTH) // (MAX_STRING_LENGTH + 1), 0)
@@ -0,0 +1,116 @@
+import mmap
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Tuple
+
+
+class MappedFile(NamedTuple):
+    fd: int
+    mtime_ns: int
+    size: int
+    mapping: Optional[mmap.mmap]
+    view: memoryview
+
+
+class MappedFileCache:
+    """LRU cache of memory-mapped files, for serving many small reads of the same files.
+
+    Each file is opened and mapped once and its descriptor is kept open. A
+    read costs one fstat() of that descriptor and a copy out of the mapping,
+    instead of an open, seek, read and close. The fstat() comes first, and
+    the read is bound-checked against the current size, because touching a
+    mapped page past the end of a file truncated in place kills the process
+    with SIGBUS; only a truncation in the moment between the fstat() and the
+    copy is not caught. A file whose size or mtime changed is remapped. The
+    path is stat()ed again at most every `check_interval` seconds to notice a
+    file replaced by a new one. At most `max_files` files stay mapped; the least
+    recently used one is unmapped first.
+    """
+
+    def __init__(self, max_files: int = 64, check_interval: float = 1.0):
+        self.max_files = max_files
+        self.check_interval = check_interval
+        self._files = OrderedDict()  # path -> MappedFile
+        self._checked = {}  # path -> monotonic time of the last stat of the path
+        self.hits = 0
+        self.misses = 0
+
+    def read(self, path: str, offset: int, size: int) -> Optional[Tuple[bytes, int]]:
+        """Return up to `size` bytes at `offset` and the file size, or None if the file is missing.
+
+        The data is empty past the end of the file.
+        """
+        entry = self._entry(path)
+        if entry is None:
+            return None
+        st = os.fstat(entry.fd)
+        if (st.st_mtime_ns, st.st_size) != (entry.mtime_ns, entry.size):
+            # Changed in place since it was mapped; map it again before touching any page
+            self.misses += 1
+            entry = self._remap(path)
+            if entry is None:
+                return None
+        else:
+            self.hits += 1
+        end = min(offset + size, entry.size, st.st_size)
+        if offset >= end:
+            return b'', entry.size
+        return bytes(entry.view[offset:end]), entry.size
+
+    def _entry(self, path: str) -> Optional[MappedFile]:
+        entry = self._files.get(path)
+        now = time.monotonic()
+        if entry is not None and now - self._checked[path] < self.check_interval:
+            self._files.move_to_end(path)
+            return entry
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._evict(path)
+            return None
+        if entry is not None and os.path.samestat(st, os.fstat(entry.fd)):
+            self._checked[path] = now
+            self._files.move_to_end(path)
+            return entry
+        self.misses += 1
+        return self._remap(path)
+
+    def _remap(self, path: str) -> Optional[MappedFile]:
+        self._evict(path)
+        try:
+            entry = self._map(path)
+        except OSError:
+            return None
+        self._files[path] = entry
+        self._checked[path] = time.monotonic()
+        while len(self._files) > self.max_files:
+            self._evict(next(iter(self._files)))
+        return entry
+
+    @staticmethod
+    def _map(path: str) -> MappedFile:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            st = os.fstat(fd)
+            if st.st_size == 0:
+                return MappedFile(fd, st.st_mtime_ns, 0, None, memoryview(b''))  # Empty files cannot be mapped
+            mapping = mmap.mmap(fd, st.st_size, access=mmap.ACCESS_READ)
+        except BaseException:
+            os.close(fd)
+            raise
+        return MappedFile(fd, st.st_mtime_ns, st.st_size, mapping, memoryview(mapping))
+
+    def _evict(self, path: str):
+        entry = self._files.pop(path, None)
+        self._checked.pop(path, None)
+        if entry is None:
+            return
+        os.close(entry.fd)
+        if entry.mapping is not None:
+            entry.view.release()
+            entry.mapping.close()
+
+    def close(self):
+        for path in list(self._files):
+            self._evict(path)
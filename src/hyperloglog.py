@@ -0,0 +1,63 @@
+import math
+from typing import Optional
+
+from blocklist_index import domain_hash
+
+
+class HyperLogLog:
+    """Approximate distinct counter using 2**precision one-byte registers.
+
+    The standard error is about 1.04 / sqrt(2**precision), i.e. 0.8% with the
+    default 16 KB of registers, however many distinct values are added.
+    Sketches with the same precision can be merged, so partial counts from
+    several files or processes combine into the count of their union.
+    """
+
+    def __init__(self, precision: int = 14, registers: Optional[bytes] = None):
+        if not 4 <= precision <= 18:
+            raise ValueError(f"HyperLogLog precision must be between 4 and 18, got {precision}")
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+        if len(self.registers) != self.size:
+            raise ValueError(f"Expected {self.size} registers, got {len(self.registers)}")
+
+    def add(self, value: str):
+        """Add a value (hashed with the 64-bit domain hash)."""
+        self.add_hash(domain_hash(value))
+
+    def add_hash(self, value: int):
+        width = 64 - self.precision
+        index = value >> width
+        rank = width - (value & ((1 << width) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog'):
+        """Fold another sketch into this one."""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        """Return the estimated number of distinct values added."""
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate while many registers are still empty
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def to_bytes(self) -> bytes:
+        """Serialize the sketch as its precision followed by the registers."""
+        return bytes([self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'HyperLogLog':
+        """Restore a sketch written by `to_bytes`."""
+        return cls(data[0], data[1:])
@@ -0,0 +1,210 @@
+import gzip
+import json
+import logging
+import re
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Records as written by BlockedRequestLog. Timestamps and domains are normally
+# found by two separate scans, which return flat lists; the combined pattern
+# pairs them up when a block has other lines, which are parsed as JSON. Domains
+# keep their JSON escapes (json.dumps writes non-ASCII as \uXXXX) until the
+# domain table is decoded. Only ISO timestamps are captured: NumPy can crash
+# instead of raising when it casts a large block holding one it cannot parse.
+RECORD_PATTERN = re.compile(rb'\{"timestamp": "(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d[^"]*)", '
+                            rb'"domain": "([^"\\]*(?:\\.[^"\\]*)*)"\}')
+TIMESTAMP_PATTERN = re.compile(rb'\{"timestamp": "(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d[^"]*)", "domain": ')
+DOMAIN_PATTERN = re.compile(rb'", "domain": "([^"\\]*(?:\\.[^"\\]*)*)"\}')
+READ_SIZE = 16 * 1024 * 1024
+
+# Bucket width in seconds and the datetime_as_string unit of each resolution
+RESOLUTIONS = {
+    'minute': (60, 'm'),
+    'hour': (3600, 'h'),
+    'day': (86400, 'D'),
+}
+
+
+def decode_domain(raw: bytes) -> str:
+    """Decode a domain captured from a log line, undoing JSON escapes such as \\u00e9."""
+    if b'\\' in raw:
+        try:
+            return json.loads(b'"' + raw + b'"')
+        except ValueError:
+            pass
+    return raw.decode('utf-8', 'replace')
+
+
+def load_record(line: bytes) -> Optional[Tuple[bytes, bytes]]:
+    """Parse a line the record pattern missed as JSON, like the other backends do.
+
+    Returns the timestamp and the domain escaped as BlockedRequestLog
+    writes it, or None if the line is not a record.
+    """
+    try:
+        record = json.loads(line)
+        timestamp, domain = record['timestamp'], record['domain']
+        if not isinstance(domain, str):
+            return None
+        np.datetime64(timestamp[:19], 's')  # Must parse like the columns do
+    except (ValueError, KeyError, TypeError):
+        return None
+    return timestamp.encode('utf-8'), json.dumps(domain)[1:-1].encode('ascii')
+
+
+class ColumnarRequests:
+    """Blocked requests held as columns: int64 epoch seconds and int32 domain codes.
+
+    Domains are dictionary-encoded, so each distinct domain is classified
+    only once and histograms, top-N lists and company breakdowns are
+    vectorized NumPy operations over the columns. Timestamps are the
+    wall-clock times written in the log, like the hour buckets of the
+    other analysis modes.
+    """
+
+    def __init__(self, timestamps, codes, domains: List[str], classify: Callable[[str], str]):
+        self.timestamps = timestamps
+        self.codes = codes
+        self.domains = domains
+        self.classify = classify
+        self._company_codes = None
+        self._companies = None
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @classmethod
+    def from_files(cls, paths: Iterable[str], classify: Callable[[str], str]) -> 'ColumnarRequests':
+        """Load plain or gzip-compressed JSON-lines logs into columns."""
+        if np is None:
+            raise RuntimeError("The NumPy backend needs numpy (pip install numpy)")
+        index = {}
+        timestamp_chunks, code_chunks = [], []
+        malformed = 0
+        for path in paths:
+            with (gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')) as f:
+                pending = b''
+                while True:
+                    data = f.read(READ_SIZE)
+                    if not data:
+                        break
+                    data = pending + data
+                    end = data.rfind(b'\n') + 1
+                    pending = data[end:]
+                    malformed += cls._parse(data[:end], index, timestamp_chunks, code_chunks)
+                if pending:
+                    malformed += cls._parse(pending, index, timestamp_chunks, code_chunks)
+        if malformed:
+            logger.warning(f"Skipped {malformed} malformed log lines")
+        domains = [decode_domain(domain) for domain in index]
+        timestamps = (np.concatenate(timestamp_chunks) if timestamp_chunks
+                      else np.empty(0, dtype=np.int64))
+        codes = np.concatenate(code_chunks) if code_chunks else np.empty(0, dtype=np.int32)
+        if len(set(domains)) < len(domains):
+            # Spellings that decode to the same domain share one code
+            first = {}
+            remap = np.fromiter((first.setdefault(domain, len(first)) for domain in domains),
+                                dtype=np.int32, count=len(domains))
+            codes = remap[codes]
+            domains = list(first)
+        return cls(timestamps, codes, domains, classify)
+
+    @staticmethod
+    def _parse(data: bytes, index: Dict[bytes, int], timestamp_chunks: list, code_chunks: list) -> int:
+        """Parse a block of complete lines; return the number of lines that were not records."""
+        stamps = TIMESTAMP_PATTERN.findall(data)
+        names = DOMAIN_PATTERN.findall(data)
+        lines = data.count(b'\n') + (0 if data.endswith(b'\n') else 1)
+        if not (len(stamps) == len(names) == lines):
+            # Blank lines are skipped and other lines parsed one by one
+            stamps, names, lines = [], [], 0
+            for line in data.split(b'\n'):
+                line = line.strip()
+                if not line:
+                    continue
+                lines += 1
+                match = RECORD_PATTERN.fullmatch(line)
+                record = match.groups() if match else load_record(line)
+                if record is not None:
+                    stamps.append(record[0])
+                    names.append(record[1])
+        if names:
+            # NumPy parses the ISO timestamps in C; the first 19 characters are the seconds
+            timestamp_chunks.append(np.array(stamps, dtype='S19').astype('datetime64[s]').astype(np.int64))
+            code_chunks.append(np.fromiter((index.setdefault(name, len(index)) for name in names),
+                                           dtype=np.int32, count=len(names)))
+        return lines - len(names)
+
+    def between(self, since: Optional[str] = None, until: Optional[str] = None) -> 'ColumnarRequests':
+        """Return the requests in [since, until); bounds are ISO dates or timestamps."""
+        mask = np.ones(len(self), dtype=bool)
+        if since:
+            mask &= self.timestamps >= np.datetime64(since, 's').astype(np.int64)
+        if until:
+            mask &= self.timestamps < np.datetime64(until, 's').astype(np.int64)
+        subset = ColumnarRequests(self.timestamps[mask], self.codes[mask], self.domains, self.classify)
+        subset._company_codes, subset._companies = self._company_codes, self._companies
+        return subset
+
+    def domain_counts(self):
+        """Return the number of requests per domain code."""
+        return np.bincount(self.codes, minlength=len(self.domains))
+
+    def unique_domains(self) -> int:
+        return int(np.count_nonzero(self.domain_counts()))
+
+    def histogram(self, resolution: str = 'hour', company: Optional[str] = None) -> Dict[str, int]:
+        """Count requests per minute, hour or day, optionally for one company only."""
+        width, unit = RESOLUTIONS[resolution]
+        timestamps = self.timestamps
+        if company is not None:
+            company_codes, companies = self.company_codes()
+            if company not in companies:
+                return {}
+            timestamps = timestamps[company_codes[self.codes] == companies.index(company)]
+        buckets, counts = np.unique(timestamps // width * width, return_counts=True)
+        labels = np.datetime_as_string(buckets.astype('datetime64[s]'), unit=unit)
+        if resolution == 'hour':
+            return {f"{label[:10]} {label[11:13]}:00": int(count) for label, count in zip(labels, counts)}
+        return {label.replace('T', ' '): int(count) for label, count in zip(labels, counts)}
+
+    def top_domains(self, limit: int = 10) -> Dict[str, int]:
+        """Return the most blocked domains and their request counts."""
+        counts = self.domain_counts()
+        limit = min(limit, int(np.count_nonzero(counts)))
+        if limit <= 0:
+            return {}
+        top = np.argpartition(-counts, limit - 1)[:limit]
+        top = top[np.lexsort((top, -counts[top]))]
+        return {self.domains[code]: int(counts[code]) for code in top}
+
+    def company_codes(self):
+        """Return the company code of every domain code and the list of company names."""
+        if self._company_codes is None or len(self._company_codes) < len(self.domains):
+            names = [self.classify(domain) for domain in self.domains]
+            companies = sorted(set(names))
+            position = {company: i for i, company in enumerate(companies)}
+            self._company_codes = np.array([position[name] for name in names], dtype=np.int32)
+            self._companies = companies
+        return self._company_codes, self._companies
+
+    def company_counts(self) -> Dict[str, int]:
+        """Return the number of requests per company."""
+        company_codes, companies = self.company_codes()
+        counts = np.bincount(company_codes, weights=self.domain_counts(), minlength=len(companies))
+        return {company: int(count) for company, count in zip(companies, counts) if count}
+
+    def to_dict(self, resolution: str = 'hour') -> Dict:
+        """Return the statistics in the layout of `blocker_statistics.json`."""
+        return {
+            'total_requests': len(self),
+            'unique_domains': self.unique_domains(),
+            'company_stats': self.company_counts(),
+            'hourly_stats': self.histogram(resolution)
+        }
@@ -0,0 +1,190 @@
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, Optional
+
+try:
+    import whois
+except ImportError:
+    whois = None
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS owners (
+    domain TEXT PRIMARY KEY,
+    owner TEXT,
+    checked REAL NOT NULL
+) WITHOUT ROWID;
+'''
+
+# Public suffixes with more than one label. A shortened form of the public
+# suffix list, enough to find the registrable domain of common ad hosts.
+MULTI_LABEL_SUFFIXES = {
+    'co.uk', 'org.uk', 'ac.uk', 'gov.uk', 'me.uk', 'ltd.uk', 'plc.uk',
+    'com.au', 'net.au', 'org.au', 'edu.au', 'gov.au',
+    'co.jp', 'ne.jp', 'or.jp', 'ac.jp', 'go.jp',
+    'co.nz', 'net.nz', 'org.nz', 'co.za', 'org.za',
+    'co.in', 'net.in', 'org.in', 'co.kr', 'or.kr', 'co.id', 'co.il', 'co.th',
+    'com.br', 'net.br', 'org.br', 'com.cn', 'net.cn', 'org.cn', 'com.hk', 'com.tw',
+    'com.mx', 'com.ar', 'com.co', 'com.tr', 'com.sg', 'com.my', 'com.ua', 'com.pl',
+    'com.ro', 'org.ro', 'com.es', 'com.pt', 'com.gr', 'com.vn', 'com.ph', 'com.pk',
+}
+
+# Registrant organisations that hide the real owner
+PRIVACY_MARKERS = ('redacted', 'privacy', 'proxy', 'withheld', 'not disclosed', 'data protected')
+
+
+def registrable_domain(domain: str) -> str:
+    """Return the registrable domain (eTLD+1), e.g. `ads.example.co.uk` -> `example.co.uk`."""
+    labels = domain.lower().rstrip('.').split('.')
+    if len(labels) >= 3 and '.'.join(labels[-2:]) in MULTI_LABEL_SUFFIXES:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+
+def whois_owner(domain: str) -> Optional[str]:
+    """Return the registrant organisation of a domain, or None if it is unknown or hidden.
+
+    Raises if the lookup itself fails, so the failure is not cached.
+    """
+    if whois is None:
+        raise RuntimeError("Ownership lookups need python-whois (pip install python-whois)")
+    entry = whois.whois(domain)
+    owner = entry.get('org') or entry.get('registrant_name')
+    if isinstance(owner, list):
+        owner = owner[0] if owner else None
+    if not owner or any(marker in owner.lower() for marker in PRIVACY_MARKERS):
+        return None
+    return owner.strip()
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across threads."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class OwnershipCache:
+    """SQLite cache of domain owners, keyed by registrable domain.
+
+    Owners are looked up with whois at most once per registrable domain and
+    `ttl` seconds; domains whose owner is unknown or hidden are cached too,
+    for `negative_ttl` seconds. Lookups run concurrently in `workers`
+    threads, spaced by a shared rate limit so whois servers do not throttle
+    them. Failed lookups are not cached and are retried on the next run. In
+    offline mode only cached owners are used.
+    """
+
+    def __init__(self, path: str = 'ownership_cache.db', ttl: float = 30 * 86400,
+                 negative_ttl: float = 86400, offline: bool = False, workers: int = 4,
+                 rate: float = 2.0, lookup: Callable[[str], Optional[str]] = whois_owner):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.offline = offline
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.lookup = lookup
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def cached(self, domains: Iterable[str], include_expired: bool = False) -> Dict[str, Optional[str]]:
+        """Return the cached owners of registrable domains; expired entries are left out."""
+        now = time.time()
+        owners = {}
+        for domain in set(domains):
+            row = self.db.execute('SELECT owner, checked FROM owners WHERE domain = ?',
+                                  (domain,)).fetchone()
+            if row is None:
+                continue
+            owner, checked = row
+            ttl = self.ttl if owner is not None else self.negative_ttl
+            if include_expired or now - checked < ttl:
+                owners[domain] = owner
+        return owners
+
+    def _lookup(self, domain: str) -> Optional[str]:
+        self.limiter.wait()
+        return self.lookup(domain)
+
+    def resolve(self, domains: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Return the owners of the given domains' registrable domains, looking up missing ones.
+
+        The result maps registrable domains to owners (None when unknown).
+        """
+        wanted = {registrable_domain(domain) for domain in domains}
+        owners = self.cached(wanted)
+        missing = sorted(wanted - owners.keys())
+        if self.offline or not missing:
+            if missing:
+                # Offline, a stale owner is better than none
+                owners.update(self.cached(missing, include_expired=True))
+            return owners
+
+        start = time.monotonic()
+        failed = 0
+        logger.info(f"Looking up the owners of {len(missing)} domains")
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self._lookup, domain): domain for domain in missing}
+            for future in as_completed(futures):
+                domain = futures[future]
+                try:
+                    owner = future.result()
+                except Exception as e:
+                    failed += 1
+                    logger.debug(f"Whois lookup for {domain} failed: {str(e)}")
+                    continue
+                owners[domain] = owner
+                # Commit each result, so an interrupted run keeps the lookups it made
+                with self.db:
+                    self.db.execute(
+                        'INSERT INTO owners VALUES (?, ?, ?) ON CONFLICT (domain) '
+                        'DO UPDATE SET owner = excluded.owner, checked = excluded.checked',
+                        (domain, owner, time.time()))
+        if failed:
+            logger.warning(f"{failed} whois lookups failed; they will be retried on the next run")
+            owners.update({domain: owner for domain, owner in
+                           self.cached(set(missing) - owners.keys(), include_expired=True).items()})
+        logger.info(f"Resolved {len(missing) - failed} owners in {time.monotonic() - start:.2f}s")
+        return owners
+
+
+class OwnerClassifier:
+    """Classifies domains by keyword, then by the owner of their registrable domain.
+
+    Domains the keyword classifier leaves at its default are attributed to
+    the company whose keywords match the owner's name (`Google LLC` ->
+    google), or else to the owner's name itself. Only holds plain data, so
+    `classify` can be sent to worker processes.
+    """
+
+    def __init__(self, classifier, owners: Dict[str, Optional[str]]):
+        self.classifier = classifier
+        self.owners = owners
+
+    def classify(self, domain: str) -> str:
+        company = self.classifier.classify(domain)
+        if company != self.classifier.default:
+            return company
+        owner = self.owners.get(registrable_domain(domain))
+        if owner is None:
+            return company
+        by_owner = self.classifier.classify(owner)
+        return owner if by_owner == self.classifier.default else by_owner
@@ -0,0 +1,132 @@
+import atexit
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def worker_log_path(path: str, worker_id: int) -> str:
+    """Return the log path of one worker, e.g. `blocked_requests.w0.jsonl`."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.w{worker_id}{ext}"
+
+
+class BlockedRequestLog:
+    """Append-only JSON-lines log of blocked requests.
+
+    `log` only puts the hit on a bounded queue; a background thread formats
+    the records and appends them in batches, flushing every `flush_interval`
+    seconds or `flush_size` records. When the file grows past `max_bytes` it
+    is rotated to `<path>.1.gz`, `<path>.2.gz`, ... keeping `backups` files.
+    If the queue is full, records are dropped and counted instead of
+    stalling the server.
+    """
+
+    def __init__(self, path: str = 'blocked_requests.jsonl', queue_size: int = 10000,
+                 flush_interval: float = 1.0, flush_size: int = 256,
+                 max_bytes: int = 64 * 1024 * 1024, backups: int = 7):
+        self.path = path
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.dropped = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def log(self, domain: str, timestamp: Optional[float] = None):
+        """Queue a blocked request without waiting for disk I/O."""
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self._queue.put_nowait((time.time() if timestamp is None else timestamp, domain))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Write all queued records and stop the writer thread."""
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._pid = None
+        if self.dropped:
+            logger.warning(f"Dropped {self.dropped} blocked request records (log queue full)")
+
+    def _start(self):
+        # The writer thread does not survive a fork, so each process starts its own
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self.queue_size)
+            self._thread = threading.Thread(target=self._run, name='blocked-request-log', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        f = open(self.path, 'a', encoding='utf-8')
+        try:
+            while True:
+                batch, stop = self._collect()
+                if batch:
+                    f.write(''.join(batch))
+                    f.flush()
+                    if f.tell() >= self.max_bytes:
+                        f.close()
+                        self._rotate()
+                        f = open(self.path, 'a', encoding='utf-8')
+                if stop:
+                    break
+        except Exception as e:
+            logger.error(f"Blocked request log writer failed: {str(e)}")
+        finally:
+            f.close()
+
+    def _collect(self):
+        """Wait for records until the batch is full or the interval expires."""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            timestamp, domain = item
+            batch.append(json.dumps({
+                'timestamp': datetime.fromtimestamp(timestamp).isoformat(),
+                'domain': domain
+            }) + '\n')
+        return batch, False
+
+    def _rotate(self):
+        """Shift `<path>.N.gz` files up by one and compress the current file."""
+        oldest = f"{self.path}.{self.backups}.gz"
+        if os.path.exists(oldest):
+            os.remove(oldest)
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}.gz"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}.gz")
+        with open(self.path, 'rb') as src, gzip.open(f"{self.path}.1.gz", 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(self.path)
+        logger.info(f"Rotated {self.path}")
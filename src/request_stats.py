@@ -0,0 +1,173 @@
+import gzip
+import json
+import logging
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+
+from hyperloglog import HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+
+def rotated_log_files(path: str) -> List[str]:
+    """Return a log file and its rotated `<path>.N.gz` backups, oldest first."""
+    directory = os.path.dirname(path) or '.'
+    pattern = re.compile(re.escape(os.path.basename(path)) + r'\.(\d+)\.gz')
+    backups = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        match = pattern.fullmatch(name)
+        if match:
+            backups.append((int(match.group(1)), os.path.join(directory, name)))
+    files = [backup for _, backup in sorted(backups, reverse=True)]
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def open_log(path: str):
+    """Open a plain or gzip-compressed JSON-lines log for reading text."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def hour_bucket(timestamp: str) -> str:
+    """Return the `YYYY-MM-DD HH:00` bucket of an ISO timestamp."""
+    if len(timestamp) >= 13 and timestamp[4] == '-' and timestamp[10] in 'T ':
+        return f"{timestamp[:10]} {timestamp[11:13]}:00"
+    return datetime.fromisoformat(timestamp).strftime('%Y-%m-%d %H:00')
+
+
+class RequestStats:
+    """Single-pass aggregate of blocked requests.
+
+    Records are folded in one at a time, so memory depends on the number of
+    distinct hours, companies and domains, not on the number of requests.
+    With `hll_precision` the distinct domains are estimated with a
+    HyperLogLog sketch, which keeps memory bounded no matter how many
+    domains appear.
+    """
+
+    def __init__(self, classify: Callable[[str], str], hll_precision: Optional[int] = None):
+        self.classify = classify
+        self.total = 0
+        self.malformed = 0
+        self.domains = HyperLogLog(hll_precision) if hll_precision else set()
+        self.companies = Counter()
+        self.hourly = Counter()
+        self._buckets = {}
+
+    @property
+    def unique_domains(self) -> int:
+        return len(self.domains)
+
+    def add(self, timestamp: str, domain: str):
+        """Count one blocked request."""
+        # Every record of the same hour shares the first 13 characters of its timestamp
+        prefix = timestamp[:13]
+        bucket = self._buckets.get(prefix)
+        if bucket is None:
+            bucket = self._buckets[prefix] = hour_bucket(timestamp)
+        self.total += 1
+        self.domains.add(domain)
+        self.companies[self.classify(domain)] += 1
+        self.hourly[bucket] += 1
+
+    def add_line(self, line: str):
+        """Count the record on one JSON line; malformed lines are counted and skipped."""
+        try:
+            record = json.loads(line)
+            self.add(record['timestamp'], record['domain'])
+        except (ValueError, KeyError, TypeError):
+            self.malformed += 1
+
+    def add_file(self, path: str):
+        """Stream one plain or gzip-compressed log file into the aggregate."""
+        try:
+            with open_log(path) as f:
+                for line in f:
+                    if line.strip():
+                        self.add_line(line)
+        except (OSError, EOFError) as e:
+            # A backup being rotated can be truncated; count what could be read
+            logger.warning(f"Could not read all of {path}: {str(e)}")
+
+    def add_files(self, paths: Iterable[str]):
+        """Stream several log files into the aggregate."""
+        for path in paths:
+            self.add_file(path)
+
+    def merge(self, other: 'RequestStats'):
+        """Fold a partial aggregate, e.g. of another log file, into this one."""
+        self.total += other.total
+        self.malformed += other.malformed
+        if isinstance(self.domains, HyperLogLog):
+            self.domains.merge(other.domains)
+        else:
+            self.domains.update(other.domains)
+        self.companies.update(other.companies)
+        self.hourly.update(other.hourly)
+
+    def __getstate__(self):
+        # Partial aggregates sent back from worker processes only carry the counts
+        state = self.__dict__.copy()
+        state['classify'] = None
+        state['_buckets'] = {}
+        return state
+
+    def to_dict(self) -> Dict:
+        """Return the statistics in the layout of `blocker_statistics.json`."""
+        return {
+            'total_requests': self.total,
+            'unique_domains': self.unique_domains,
+            'company_stats': dict(self.companies),
+            'hourly_stats': dict(self.hourly)
+        }
+
+
+def aggregate_file(path: str, classify: Callable[[str], str],
+                   hll_precision: Optional[int] = None) -> RequestStats:
+    """Aggregate one log file."""
+    stats = RequestStats(classify, hll_precision)
+    stats.add_file(path)
+    return stats
+
+
+# Classifier of a worker process, set once by the pool initializer
+_worker_classify: Optional[Callable[[str], str]] = None
+
+
+def _init_worker(classify: Callable[[str], str]):
+    global _worker_classify
+    _worker_classify = classify
+
+
+def _aggregate_in_worker(path: str, hll_precision: Optional[int]) -> RequestStats:
+    return aggregate_file(path, _worker_classify, hll_precision)
+
+
+def aggregate_files_parallel(paths: List[str], classify: Callable[[str], str],
+                             hll_precision: Optional[int] = None,
+                             workers: Optional[int] = None) -> RequestStats:
+    """Aggregate log files in a process pool and merge the partial results.
+
+    Each file is one task, and a task only carries its path. `classify` is
+    handed to each worker once, when the pool starts it, and the worker's
+    copy keeps its memo across all the files it aggregates. It must be a
+    module-level function or a method of a picklable object.
+    """
+    stats = RequestStats(classify, hll_precision)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(classify,)) as executor:
+        futures = [executor.submit(_aggregate_in_worker, path, hll_precision) for path in paths]
+        for future in as_completed(futures):
+            stats.merge(future.result())
+    return stats
@@ -0,0 +1,167 @@
+import gzip
+import json
+import logging
+import sqlite3
+from collections import Counter
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from request_stats import hour_bucket
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS domain_hourly (
+    hour TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    PRIMARY KEY (hour, domain)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS company_hourly (
+    hour TEXT NOT NULL,
+    company TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    PRIMARY KEY (hour, company)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hourly (
+    hour TEXT PRIMARY KEY,
+    requests INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS watermarks (
+    identity TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    offset INTEGER NOT NULL
+) WITHOUT ROWID;
+'''
+
+
+class RollupStore:
+    """SQLite store of hourly blocked-request rollups per domain and company.
+
+    Each log file is identified by its first line, so a file keeps its
+    watermark when rotation renames and compresses it. Ingesting the same
+    files again only reads the lines added since the last run, and the
+    rollups and watermarks are committed in the same transaction, so an
+    interrupted run never counts a record twice. Time-range queries read
+    only the rollups.
+    """
+
+    def __init__(self, path: str = 'blocker_rollups.db', flush_size: int = 100000):
+        self.path = path
+        self.flush_size = flush_size
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def ingest(self, paths: Iterable[str], classify: Callable[[str], str]) -> int:
+        """Add the records appended to the given log files since the last run; return how many."""
+        total = 0
+        for path in paths:
+            try:
+                total += self._ingest_file(path, classify)
+            except (OSError, EOFError) as e:
+                logger.warning(f"Could not read all of {path}: {str(e)}")
+        return total
+
+    def _ingest_file(self, path: str, classify: Callable[[str], str]) -> int:
+        # Offsets are byte positions in the uncompressed log, so they stay valid after rotation
+        with (gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')) as f:
+            first_line = f.readline()
+            if not first_line.endswith(b'\n'):
+                return 0  # Empty, or the first record is still being written
+            identity = first_line.decode('utf-8', 'replace')
+            row = self.db.execute('SELECT offset FROM watermarks WHERE identity = ?',
+                                  (identity,)).fetchone()
+            offset = row[0] if row else 0
+            f.seek(offset)
+            counts = Counter()
+            ingested = 0
+            buckets = {}
+            while True:
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    break  # End of file or a partly written last line
+                offset += len(line)
+                try:
+                    record = json.loads(line)
+                    timestamp, domain = record['timestamp'], record['domain']
+                    prefix = timestamp[:13]
+                    bucket = buckets.get(prefix)
+                    if bucket is None:
+                        bucket = buckets[prefix] = hour_bucket(timestamp)
+                except (ValueError, KeyError, TypeError):
+                    continue
+                counts[(bucket, domain)] += 1
+                ingested += 1
+                if len(counts) >= self.flush_size:
+                    self._flush(counts, classify, identity, path, offset)
+                    counts = Counter()
+            self._flush(counts, classify, identity, path, offset)
+        if ingested:
+            logger.info(f"Ingested {ingested} records from {path}")
+        return ingested
+
+    def _flush(self, counts: Counter, classify: Callable[[str], str],
+               identity: str, path: str, offset: int):
+        """Add counts to the rollups and move the file's watermark in one transaction."""
+        companies = Counter()
+        hours = Counter()
+        for (hour, domain), requests in counts.items():
+            companies[(hour, classify(domain))] += requests
+            hours[hour] += requests
+        with self.db:
+            self.db.executemany(
+                'INSERT INTO domain_hourly VALUES (?, ?, ?) ON CONFLICT (hour, domain) '
+                'DO UPDATE SET requests = requests + excluded.requests',
+                ((hour, domain, requests) for (hour, domain), requests in counts.items()))
+            self.db.executemany(
+                'INSERT INTO company_hourly VALUES (?, ?, ?) ON CONFLICT (hour, company) '
+                'DO UPDATE SET requests = requests + excluded.requests',
+                ((hour, company, requests) for (hour, company), requests in companies.items()))
+            self.db.executemany(
+                'INSERT INTO hourly VALUES (?, ?) ON CONFLICT (hour) '
+                'DO UPDATE SET requests = requests + excluded.requests',
+                hours.items())
+            self.db.execute(
+                'INSERT INTO watermarks VALUES (?, ?, ?) ON CONFLICT (identity) '
+                'DO UPDATE SET path = excluded.path, offset = excluded.offset',
+                (identity, path, offset))
+
+    @staticmethod
+    def _range(since: Optional[str], until: Optional[str]) -> Tuple[str, Tuple[str, ...]]:
+        # Hour buckets sort as text, so a range is a pair of string comparisons
+        clauses, params = [], []
+        if since:
+            clauses.append('hour >= ?')
+            params.append(hour_bucket(since))
+        if until:
+            clauses.append('hour < ?')
+            params.append(hour_bucket(until))
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', tuple(params)
+
+    def query(self, since: Optional[str] = None, until: Optional[str] = None) -> Dict:
+        """Return statistics for hours in [since, until) in the layout of `blocker_statistics.json`.
+
+        Bounds are ISO dates or timestamps and are truncated to the hour.
+        """
+        where, params = self._range(since, until)
+        hourly = dict(self.db.execute(f'SELECT hour, requests FROM hourly{where}', params))
+        companies = dict(self.db.execute(
+            f'SELECT company, SUM(requests) FROM company_hourly{where} GROUP BY company', params))
+        unique_domains = self.db.execute(
+            f'SELECT COUNT(DISTINCT domain) FROM domain_hourly{where}', params).fetchone()[0]
+        return {
+            'total_requests': sum(hourly.values()),
+            'unique_domains': unique_domains,
+            'company_stats': companies,
+            'hourly_stats': hourly
+        }
+
+    def top_domains(self, limit: int = 10, since: Optional[str] = None,
+                    until: Optional[str] = None) -> Dict[str, int]:
+        """Return the most blocked domains in [since, until)."""
+        where, params = self._range(since, until)
+        return dict(self.db.execute(
+            f'SELECT domain, SUM(requests) AS total FROM domain_hourly{where} '
+            f'GROUP BY domain ORDER BY total DESC, domain LIMIT ?', params + (limit,)))
@@ -1,7 +1,18 @@
 import requests
+import argparse
+import hashlib
+import json
 import logging
-from typing import Set
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 import os
+from requests.adapters import HTTPAdapter
+
+from blocklist_index import (GENERATION_PREFIX, BlocklistDelta, normalize_domain, read_domains,
+                             read_generation, write_compiled_index, write_delta)
+from blocklist_parser import CHUNK_SIZE, BlocklistBuilder, parse_hosts, read_file_chunks
+from bloom_filter import BloomFilter
 
 # Configure logging
 logging.basicConfig(
@@ -19,48 +30,201 @@ BLOCKLIST_SOURCES = [
     'https://hostfiles.frogeye.fr/firstparty-trackers-hosts.txt'
 ]
 
-def download_blocklist(url: str) -> Set[str]:
-    """Download and parse a blocklist from a URL."""
+# Parsed copies of the sources and their validators, for conditional requests
+CACHE_DIR = 'blocklist_cache'
+DOWNLOAD_WORKERS = 8
+# Bumped when the parser changes, so cached domains from an older parser are re-parsed
+CACHE_FORMAT = 2
+
+def create_session(pool_size: int = DOWNLOAD_WORKERS) -> requests.Session:
+    """Create a session whose connection pool is shared by the download threads."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def cache_paths(cache_dir: str, url: str) -> Tuple[str, str]:
+    """Return the metadata and domain list paths caching one source."""
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{key}.json"), os.path.join(cache_dir, f"{key}.txt")
+
+def load_cached_source(cache_dir: str, url: str) -> Tuple[Dict[str, str], Optional[Set[str]]]:
+    """Return the cached validators and domains of a source, or ({}, None)."""
+    meta_path, domains_path = cache_paths(cache_dir, url)
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        
-        domains = set()
-        for line in response.text.splitlines():
-            # Skip comments and empty lines
-            if line.startswith('#') or not line.strip():
-                continue
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta.get('format') != CACHE_FORMAT:
+            return {}, None
+        with open(domains_path, 'r') as f:
+            domains = {line.rstrip('\n') for line in f if line.strip()}
+        return meta, domains
+    except (OSError, ValueError):
+        return {}, None
+
+def save_cached_source(cache_dir: str, url: str, response: requests.Response, domains: Set[str]):
+    """Cache the parsed domains of a source with its ETag and Last-Modified headers."""
+    meta_path, domains_path = cache_paths(cache_dir, url)
+    os.makedirs(cache_dir, exist_ok=True)
+    # The domain list is replaced before the metadata, so validators never describe a stale list
+    with open(f"{domains_path}.tmp", 'w') as f:
+        f.writelines(f"{domain}\n" for domain in domains)
+    os.replace(f"{domains_path}.tmp", domains_path)
+    meta = {'format': CACHE_FORMAT,
+            'url': url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified')}
+    with open(f"{meta_path}.tmp", 'w') as f:
+        json.dump(meta, f)
+    os.replace(f"{meta_path}.tmp", meta_path)
+
+def is_url(source: str) -> bool:
+    """Check whether a blocklist source is a URL rather than a local file."""
+    return source.startswith(('http://', 'https://'))
+
+def read_blocklist_file(path: str) -> Set[str]:
+    """Parse a local hosts or bare-domain list."""
+    try:
+        domains = set(parse_hosts(read_file_chunks(path)))
+        logger.info(f"Read {len(domains)} domains from {path}")
+        return domains
+    except Exception as e:
+        logger.error(f"Error reading {path}: {str(e)}")
+        return set()
+
+def download_blocklist(url: str, session: Optional[requests.Session] = None,
+                       cache_dir: Optional[str] = CACHE_DIR) -> Set[str]:
+    """Download and parse a blocklist from a URL or local file.
+
+    The response is parsed as it streams in, so only the source's domains
+    are kept in memory, never the whole file.
+
+    With a cache directory the request carries If-None-Match and
+    If-Modified-Since from the previous download, and a 304 answer reuses the
+    cached domains without downloading or parsing the list again. If the
+    download fails, the cached domains are used so one unreachable source
+    does not empty its part of the blocklist.
+    """
+    if not is_url(url):
+        return read_blocklist_file(url)
+    meta, cached = load_cached_source(cache_dir, url) if cache_dir else ({}, None)
+    headers = {}
+    if cached is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    try:
+        with (session or requests).get(url, headers=headers, timeout=10, stream=True) as response:
+            if response.status_code == 304 and cached is not None:
+                logger.info(f"Not modified, reusing {len(cached)} cached domains from {url}")
+                return cached
+            response.raise_for_status()
             
-            # Parse hosts file format
-            parts = line.strip().split()
-            if len(parts) >= 2:
-                domain = parts[1].strip()
-                if domain and not domain.startswith('#'):
-                    domains.add(domain)
+            domains = set(parse_hosts(response.iter_content(CHUNK_SIZE)))
+        if cache_dir:
+            save_cached_source(cache_dir, url, response, domains)
         
         logger.info(f"Downloaded {len(domains)} domains from {url}")
         return domains
     except Exception as e:
         logger.error(f"Error downloading {url}: {str(e)}")
+        if cached is not None:
+            logger.warning(f"Using {len(cached)} cached domains for {url}")
+            return cached
         return set()
 
-def main():
+def download_all(urls: List[str], cache_dir: Optional[str] = CACHE_DIR,
+                 workers: int = DOWNLOAD_WORKERS, allowed: Iterable[str] = ()) -> Set[str]:
+    """Download all sources concurrently over one pooled session and merge them.
+
+    Each source is merged as soon as it arrives. Rules already covered by a
+    blocked parent domain are dropped, since the server blocks subdomains of
+    every listed domain anyway.
+    """
+    builder = BlocklistBuilder(allowed)
+    with create_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(download_blocklist, url, session, cache_dir) for url in urls]
+        for future in as_completed(futures):
+            builder.update(future.result())
+    builder.prune()
+    logger.info(f"Dropped {builder.skipped} domains covered by a parent domain rule")
+    return builder.domains
+
+def write_generation_delta(blocked_path: str, delta_path: str, domains: Set[str]) -> int:
+    """Write the delta from the list in `blocked_path` to `domains`; return the new generation.
+
+    Without a previous list there is nothing to diff against, so any old
+    delta is removed and servers do a full reload.
+    """
+    base_generation = read_generation(blocked_path)
+    generation = base_generation + 1
+    try:
+        previous = {normalize_domain(domain) for domain in read_domains(blocked_path)}
+    except FileNotFoundError:
+        if os.path.exists(delta_path):
+            os.remove(delta_path)
+        return generation
+    delta = BlocklistDelta(generation, base_generation,
+                           sorted(domains - previous), sorted(previous - domains))
+    write_delta(delta_path, delta)
+    logger.info(f"Saved delta {base_generation} -> {generation} to {delta_path}: "
+                f"{len(delta.added)} added, {len(delta.removed)} removed")
+    return generation
+
+def main(bloom_fp_rate: float = 0.01, cache_dir: Optional[str] = CACHE_DIR,
+         workers: int = DOWNLOAD_WORKERS, sources: Optional[List[str]] = None):
     """Download and combine blocklists."""
-    all_domains = set()
+    sources = sources or BLOCKLIST_SOURCES
+    allowed_domains = []
+    if os.path.exists('allowed_domains.txt'):
+        with open('allowed_domains.txt', 'r') as f:
+            allowed_domains = [line.strip() for line in f
+                               if line.strip() and not line.startswith('#')]
+
+    start = time.monotonic()
+    all_domains = download_all(sources, cache_dir, workers, allowed_domains)
+    logger.info(f"Fetched {len(sources)} sources in {time.monotonic() - start:.2f}s")
     
-    for url in BLOCKLIST_SOURCES:
-        domains = download_blocklist(url)
-        all_domains.update(domains)
+    # Delta against the previous generation, written first so that a server
+    # reloading on the new text file always finds it
+    generation = write_generation_delta('blocked_domains.txt', 'blocked_domains.delta', all_domains)
     
     # Remove duplicates and sort
     all_domains = sorted(all_domains)
     
     # Save to file
-    with open('blocked_domains.txt', 'w') as f:
+    with open('blocked_domains.txt.tmp', 'w') as f:
+        f.write(f"{GENERATION_PREFIX}{generation}\n")
         for domain in all_domains:
             f.write(f"{domain}\n")
+    os.replace('blocked_domains.txt.tmp', 'blocked_domains.txt')
     
-    logger.info(f"Saved {len(all_domains)} unique domains to blocked_domains.txt")
+    logger.info(f"Saved {len(all_domains)} unique domains to blocked_domains.txt "
+                f"(generation {generation})")
+
+    # Compiled index that the DNS server memory-maps instead of parsing the text file
+    write_compiled_index('blocked_domains.idx', all_domains, allowed_domains)
+    logger.info("Saved compiled index to blocked_domains.idx")
+
+    # Prefilter for `dns_server.py --prefilter`; sized for the list at the requested error rate per query
+    bloom = BloomFilter.from_domains(all_domains, len(all_domains), bloom_fp_rate)
+    bloom.save('blocked_domains.bloom')
+    logger.info(f"Saved Bloom filter to blocked_domains.bloom ({len(bloom.bits)} bytes, "
+                f"{bloom.num_hashes} hashes, {bloom_fp_rate:.2%} false positives per query)")
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Download and combine ad domain blocklists')
+    parser.add_argument('--bloom-fp-rate', type=float, default=0.01, metavar='RATE',
+                        help='false-positive rate per query of the Bloom prefilter (default 0.01)')
+    parser.add_argument('--cache-dir', default=CACHE_DIR,
+                        help='directory caching downloaded sources for conditional requests '
+                             '("" disables the cache)')
+    parser.add_argument('--workers', type=int, default=DOWNLOAD_WORKERS,
+                        help='number of sources downloaded at the same time')
+    parser.add_argument('--source', action='append', default=[], metavar='URL_OR_PATH',
+                        help='blocklist URL or local hosts/domain list file to use instead of '
+                             'the built-in sources (repeatable)')
+    args = parser.parse_args()
+    main(args.bloom_fp_rate, args.cache_dir or None, args.workers, args.source) 
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import os
+import queue
+import random
+import socket
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def parse_upstream(spec: str, default_port: int = 53) -> Tuple[str, int]:
+    """Parse an upstream resolver given as `host` or `host:port`."""
+    host, sep, port = spec.rpartition(':')
+    if not sep:
+        return spec, default_port
+    return host, int(port)
+
+
+class UpstreamPool:
+    """Forward raw DNS queries to upstream resolvers over pooled UDP sockets.
+
+    Each query borrows a pre-opened socket from the pool, is sent with a fresh
+    random transaction ID and is matched on that ID and the upstream address.
+    When an upstream times out, the next one is tried and becomes the
+    preferred upstream for later queries.
+    """
+
+    def __init__(self, upstreams: List[Tuple[str, int]], pool_size: int = 8,
+                 timeout: float = 1.0):
+        if not upstreams:
+            raise ValueError("At least one upstream resolver is required")
+        # Replies are matched on the source address, so hostnames are resolved once here
+        self.upstreams = [(socket.gethostbyname(host), port) for host, port in upstreams]
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.preferred = 0
+        self.sockets = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._random = random.SystemRandom()
+
+    def open(self):
+        """Open the socket pool for the current process.
+
+        Sockets are never shared across a fork, otherwise workers would read
+        each other's replies.
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.sockets = queue.Queue()
+            for _ in range(self.pool_size):
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.bind(('0.0.0.0', 0))
+                self.sockets.put(sock)
+            self._pid = os.getpid()
+            logger.info(f"Opened {self.pool_size} upstream sockets for {self.upstreams}")
+
+    def close(self):
+        """Close all pooled sockets."""
+        with self._lock:
+            if self.sockets is None:
+                return
+            while True:
+                try:
+                    self.sockets.get_nowait().close()
+                except queue.Empty:
+                    break
+            self.sockets = None
+            self._pid = None
+
+    def forward(self, query: bytes) -> Optional[bytes]:
+        """Send a query upstream and return the reply with the original ID.
+
+        Returns None if no upstream answered within the timeout.
+        """
+        if len(query) < 12:
+            return None
+        if self._pid != os.getpid():
+            self.open()
+        client_id = bytes(query[:2])
+        sock = self.sockets.get()
+        try:
+            first = self.preferred
+            for attempt in range(len(self.upstreams)):
+                index = (first + attempt) % len(self.upstreams)
+                upstream = self.upstreams[index]
+                upstream_id = struct.pack('!H', self._random.getrandbits(16))
+                reply = self._exchange(sock, upstream_id + query[2:], upstream_id, upstream)
+                if reply is not None:
+                    self.preferred = index
+                    return client_id + reply[2:]
+                logger.warning(f"Upstream {upstream[0]}:{upstream[1]} did not answer, failing over")
+            return None
+        finally:
+            self.sockets.put(sock)
+
+    def _exchange(self, sock: socket.socket, query: bytes, query_id: bytes,
+                  upstream: Tuple[str, int]) -> Optional[bytes]:
+        """Send one query and wait for the reply carrying the same ID."""
+        deadline = time.monotonic() + self.timeout
+        try:
+            sock.sendto(query, upstream)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                sock.settimeout(remaining)
+                reply, addr = sock.recvfrom(4096)
+                # Late replies to earlier timed-out queries on this socket are dropped here
+                if reply[:2] == query_id and addr == upstream:
+                    return reply
+        except socket.timeout:
+            return None
+        except OSError as e:
+            logger.error(f"Error forwarding to {upstream[0]}:{upstream[1]}: {str(e)}")
+            return None
+
+
+class AsyncUpstreamPool:
+    """Forward raw DNS queries to upstream resolvers from an asyncio event loop.
+
+    All queries share one non-blocking UDP endpoint. Each one is sent with a
+    random transaction ID that is not already in flight to that upstream, and
+    waits on a future that the endpoint resolves when the reply with that ID
+    arrives from that upstream. Nothing blocks, so the number of queries in
+    flight is only limited by `max_pending`. Failover works as in UpstreamPool.
+    """
+
+    def __init__(self, upstreams: List[Tuple[str, int]], timeout: float = 1.0,
+                 max_pending: int = 0x8000):
+        if not upstreams:
+            raise ValueError("At least one upstream resolver is required")
+        self.upstreams = [(socket.gethostbyname(host), port) for host, port in upstreams]
+        self.timeout = timeout
+        # At most half of the ID space is in use, so a free ID is found in about two tries
+        self.max_pending = max_pending
+        self.preferred = 0
+        self.transport = None
+        self.pending: Dict[Tuple[bytes, Tuple[str, int]], asyncio.Future] = {}
+        self._random = random.SystemRandom()
+
+    async def open(self):
+        """Open the upstream endpoint on the running event loop."""
+        if self.transport is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: UpstreamProtocol(self.pending), local_addr=('0.0.0.0', 0))
+        logger.info(f"Opened asyncio upstream endpoint for {self.upstreams}")
+
+    def close(self):
+        """Close the endpoint and cancel the queries still waiting for a reply."""
+        if self.transport is None:
+            return
+        self.transport.close()
+        self.transport = None
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+
+    async def forward(self, query: bytes) -> Optional[bytes]:
+        """Send a query upstream and return the reply with the original ID.
+
+        Returns None if no upstream answered within the timeout, or if too
+        many queries are already in flight.
+        """
+        if len(query) < 12:
+            return None
+        if len(self.pending) >= self.max_pending:
+            logger.warning(f"{len(self.pending)} upstream queries in flight, dropping one")
+            return None
+        if self.transport is None:
+            await self.open()
+        loop = asyncio.get_running_loop()
+        client_id = bytes(query[:2])
+        first = self.preferred
+        for attempt in range(len(self.upstreams)):
+            index = (first + attempt) % len(self.upstreams)
+            upstream = self.upstreams[index]
+            key = (self._free_id(upstream), upstream)
+            future = loop.create_future()
+            self.pending[key] = future
+            try:
+                self.transport.sendto(key[0] + query[2:], upstream)
+                reply = await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Upstream {upstream[0]}:{upstream[1]} did not answer, failing over")
+                continue
+            finally:
+                self.pending.pop(key, None)
+            self.preferred = index
+            return client_id + reply[2:]
+        return None
+
+    def _free_id(self, upstream: Tuple[str, int]) -> bytes:
+        """Pick a random transaction ID not in flight to an upstream."""
+        while True:
+            query_id = struct.pack('!H', self._random.getrandbits(16))
+            if (query_id, upstream) not in self.pending:
+                return query_id
+
+
+class UpstreamProtocol(asyncio.DatagramProtocol):
+    """Hands each upstream reply to the query waiting for its ID and source."""
+
+    def __init__(self, pending: Dict[Tuple[bytes, Tuple[str, int]], asyncio.Future]):
+        self.pending = pending
+
+    def datagram_received(self, data: bytes, addr: Tuple[str, int]):
+        # Late replies to timed-out queries and replies from other hosts match nothing
+        future = self.pending.get((data[:2], addr))
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc: Exception):
+        logger.error(f"Error forwarding to upstream: {str(exc)}")
@@ -0,0 +1,120 @@
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from update_blocklist import create_session, download_blocklist, load_cached_source
+
+logging.disable(logging.CRITICAL)
+
+
+class BlocklistHandler(BaseHTTPRequestHandler):
+    """Serves the server's current list with an ETag, or fails when told to."""
+
+    def do_GET(self):
+        source = self.server.source
+        source.requests.append(dict(self.headers))
+        if source.fail:
+            self.send_error(500)
+            return
+        if self.headers.get('If-None-Match') == source.etag:
+            self.send_response(304)
+            self.send_header('ETag', source.etag)
+            self.end_headers()
+            return
+        body = source.body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('ETag', source.etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BlocklistSource:
+    def __init__(self):
+        self.body = '0.0.0.0 ads.example.com\n0.0.0.0 tracker.example.net\n'
+        self.etag = '"v1"'
+        self.fail = False
+        self.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), BlocklistHandler)
+        self.server.source = self
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hosts"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+class ConditionalDownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.source = BlocklistSource()
+        self.cache_dir = tempfile.mkdtemp()
+        self.session = create_session(1)
+
+    def tearDown(self):
+        self.session.close()
+        self.source.close()
+        shutil.rmtree(self.cache_dir)
+
+    def download(self):
+        return download_blocklist(self.source.url, self.session, self.cache_dir)
+
+    def test_first_download_is_cached(self):
+        domains = self.download()
+        self.assertEqual(domains, {'ads.example.com', 'tracker.example.net'})
+        self.assertNotIn('If-None-Match', self.source.requests[0])
+        meta, cached = load_cached_source(self.cache_dir, self.source.url)
+        self.assertEqual(meta['etag'], '"v1"')
+        self.assertEqual(cached, domains)
+
+    def test_not_modified_reuses_cache(self):
+        first = self.download()
+        # A 304 has no body, so the domains can only come from the cache
+        self.source.body = ''
+        self.assertEqual(self.download(), first)
+        self.assertEqual(self.source.requests[1].get('If-None-Match'), '"v1"')
+
+    def test_new_version_replaces_cache(self):
+        self.download()
+        self.source.body = '0.0.0.0 new.example.org\n'
+        self.source.etag = '"v2"'
+        self.assertEqual(self.download(), {'new.example.org'})
+        self.assertEqual(self.source.requests[1].get('If-None-Match'), '"v1"')
+        meta, cached = load_cached_source(self.cache_dir, self.source.url)
+        self.assertEqual(meta['etag'], '"v2"')
+        self.assertEqual(cached, {'new.example.org'})
+
+    def test_failed_source_keeps_previous_copy(self):
+        first = self.download()
+        self.source.fail = True
+        self.assertEqual(self.download(), first)
+        meta, cached = load_cached_source(self.cache_dir, self.source.url)
+        self.assertEqual(meta['etag'], '"v1"')
+        self.assertEqual(cached, first)
+
+    def test_unreachable_source_keeps_previous_copy(self):
+        first = self.download()
+        self.source.close()
+        self.assertEqual(self.download(), first)
+        self.source = BlocklistSource()  # For tearDown
+
+    def test_failed_source_without_cache_is_empty(self):
+        self.source.fail = True
+        self.assertEqual(self.download(), set())
+        self.assertEqual(load_cached_source(self.cache_dir, self.source.url), ({}, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from dns_server import DNSServer
+from dns_wire import parse_header
+from upstream import AsyncUpstreamPool, UpstreamPool
+
+logging.disable(logging.CRITICAL)
+
+
+def build_query(query_id: int, name: bytes = b'\x07example\x03com\x00', qtype: int = 1) -> bytes:
+    return struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0) + name + struct.pack('!HH', qtype, 1)
+
+
+class StubResolver:
+    """Localhost UDP resolver that answers each query with its question and a marker byte.
+
+    With `answer=False` it never replies. With `decoy=True` every real reply
+    is preceded by one carrying the wrong transaction ID.
+    """
+
+    def __init__(self, marker: bytes = b'\x01', answer: bool = True, decoy: bool = False):
+        self.marker = marker
+        self.answer = answer
+        self.decoy = decoy
+        self.received = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.05)
+        self.stopped = threading.Event()
+        self.address = self.sock.getsockname()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while not self.stopped.is_set():
+            try:
+                query, addr = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            self.received.append(query)
+            if not self.answer:
+                continue
+            reply = bytearray(query)
+            reply[2] |= 0x80  # QR
+            reply += self.marker
+            if self.decoy:
+                wrong_id = struct.pack('!H', (struct.unpack('!H', query[:2])[0] + 1) & 0xFFFF)
+                self.sock.sendto(wrong_id + bytes(reply[2:-1]) + b'\xff', addr)
+            self.sock.sendto(bytes(reply), addr)
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.sock.close()
+
+
+class UpstreamPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.stubs = []
+        self.pool = None
+
+    def tearDown(self):
+        if self.pool is not None:
+            self.pool.close()
+        for stub in self.stubs:
+            stub.close()
+
+    def stub(self, **kwargs) -> StubResolver:
+        stub = StubResolver(**kwargs)
+        self.stubs.append(stub)
+        return stub
+
+    def make_pool(self, stubs, timeout: float = 0.2) -> UpstreamPool:
+        self.pool = UpstreamPool([stub.address for stub in stubs], pool_size=2, timeout=timeout)
+        return self.pool
+
+    def test_reply_keeps_client_id(self):
+        stub = self.stub()
+        query = build_query(0x1234)
+        reply = self.make_pool([stub]).forward(query)
+        self.assertEqual(reply[:2], query[:2])
+        self.assertEqual(reply[2:-1], bytes([query[2] | 0x80]) + query[3:])
+        self.assertEqual(reply[-1:], stub.marker)
+
+    def test_reply_with_wrong_id_is_ignored(self):
+        stub = self.stub(decoy=True)
+        pool = self.make_pool([stub])
+        for query_id in range(1, 6):
+            reply = pool.forward(build_query(query_id))
+            self.assertEqual(struct.unpack('!H', reply[:2])[0], query_id)
+            self.assertEqual(reply[-1:], stub.marker)
+
+    def test_fails_over_to_next_upstream(self):
+        silent = self.stub(answer=False)
+        backup = self.stub(marker=b'\x02')
+        pool = self.make_pool([silent, backup])
+        reply = pool.forward(build_query(7))
+        self.assertEqual(reply[-1:], b'\x02')
+        self.assertEqual(len(silent.received), 1)
+        # The upstream that answered is tried first from now on
+        self.assertEqual(pool.preferred, 1)
+        pool.forward(build_query(8))
+        self.assertEqual(len(silent.received), 1)
+        self.assertEqual(len(backup.received), 2)
+
+    def test_returns_none_when_no_upstream_answers(self):
+        silent = self.stub(answer=False)
+        other = self.stub(answer=False)
+        self.assertIsNone(self.make_pool([silent, other]).forward(build_query(9)))
+        self.assertEqual((len(silent.received), len(other.received)), (1, 1))
+
+
+class AsyncUpstreamPoolTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.stubs = []
+        self.pool = None
+
+    async def asyncTearDown(self):
+        if self.pool is not None:
+            self.pool.close()
+
+    def tearDown(self):
+        for stub in self.stubs:
+            stub.close()
+
+    def stub(self, **kwargs) -> StubResolver:
+        stub = StubResolver(**kwargs)
+        self.stubs.append(stub)
+        return stub
+
+    def make_pool(self, stubs, timeout: float = 0.2) -> AsyncUpstreamPool:
+        self.pool = AsyncUpstreamPool([stub.address for stub in stubs], timeout=timeout)
+        return self.pool
+
+    async def test_reply_with_wrong_id_is_ignored(self):
+        pool = self.make_pool([self.stub(decoy=True)])
+        for query_id in range(1, 6):
+            reply = await pool.forward(build_query(query_id))
+            self.assertEqual(struct.unpack('!H', reply[:2])[0], query_id)
+            self.assertEqual(reply[-1:], b'\x01')
+
+    async def test_concurrent_replies_keep_their_client_ids(self):
+        pool = self.make_pool([self.stub()])
+        queries = [build_query(query_id) for query_id in range(64)]
+        replies = await asyncio.gather(*(pool.forward(query) for query in queries))
+        for query, reply in zip(queries, replies):
+            self.assertEqual(reply[:2], query[:2])
+            self.assertEqual(reply[-1:], b'\x01')
+        self.assertEqual(pool.pending, {})
+
+    async def test_timeouts_do_not_queue_behind_each_other(self):
+        silent = self.stub(answer=False)
+        pool = self.make_pool([silent], timeout=0.3)
+        started = time.monotonic()
+        # Far more queries than UpstreamPool has sockets, all waiting at once
+        replies = await asyncio.gather(*(pool.forward(build_query(i)) for i in range(64)))
+        self.assertEqual(replies, [None] * 64)
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual(len(silent.received), 64)
+
+    async def test_fails_over_to_next_upstream(self):
+        silent = self.stub(answer=False)
+        backup = self.stub(marker=b'\x02')
+        pool = self.make_pool([silent, backup])
+        reply = await pool.forward(build_query(7))
+        self.assertEqual(reply[-1:], b'\x02')
+        self.assertEqual(pool.preferred, 1)
+        await pool.forward(build_query(8))
+        self.assertEqual((len(silent.received), len(backup.received)), (1, 2))
+
+    async def test_full_pool_refuses_new_queries(self):
+        pool = self.make_pool([self.stub()])
+        pool.max_pending = 0
+        self.assertIsNone(await pool.forward(build_query(9)))
+
+
+class ForwardingTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        # DNSServer reads the blocklist files from the working directory
+        os.chdir(os.path.dirname(__file__))
+        self.silent = StubResolver(answer=False)
+
+    def tearDown(self):
+        self.server.upstream.close()
+        self.silent.close()
+        os.chdir(self.cwd)
+
+    def test_unanswered_query_gets_servfail(self):
+        self.server = DNSServer('127.0.0.1', 0, [self.silent.address], upstream_timeout=0.2)
+        query = build_query(0xBEEF, b'\x03WwW\x07Example\x03CoM\x00', qtype=28)
+        response = self.server.handle_query(query, ('127.0.0.1', 5300))
+        header = parse_header(response)
+        self.assertEqual(header.id, 0xBEEF)
+        self.assertEqual(header.flags & 0x000F, 2)  # SERVFAIL
+        self.assertTrue(header.flags & 0x8000)
+        self.assertEqual(header.ancount, 0)
+        # The question is echoed as the client sent it, case and AAAA type included
+        self.assertEqual(response[12:], query[12:])
+        self.assertEqual(self.server.stats['upstream_failures'], 1)
+
+    def test_unanswered_async_query_gets_servfail(self):
+        self.server = DNSServer('127.0.0.1', 0, [self.silent.address], upstream_timeout=0.2)
+        query = build_query(0xBEEF)
+
+        async def ask():
+            try:
+                return await self.server.handle_query_async(query, ('127.0.0.1', 5300))
+            finally:
+                self.server.async_upstream.close()
+
+        response = asyncio.run(ask())
+        self.assertEqual(parse_header(response).flags & 0x000F, 2)  # SERVFAIL
+        self.assertEqual(response[12:], query[12:])
+        self.assertEqual(self.server.stats['upstream_failures'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()